@@ -1,27 +1,46 @@
 
 import asyncio
+import json
 import uuid
 import os
-from typing import List
+from typing import List, Optional
 
 from fastapi import (
     APIRouter, Depends, HTTPException, status, Response,
-    WebSocket, WebSocketDisconnect, File, UploadFile, Request
+    WebSocket, WebSocketDisconnect, File, UploadFile, Request, Query
 )
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi_cache.decorator import cache
 
-from . import crud, schemas, models, security, services
-from .deps import get_db, get_current_user
+from . import crud, schemas, models, security, services, read_state, metrics
+from .deps import get_db, get_read_db, get_current_user, resolve_session_user
+from .database import AsyncSessionLocal
+from .session_cache import session_cache
+from .sharding import shard_router, WS_WRONG_SHARD
+from .presence import presence
 from .limiter import limiter
-from .minio_service import minio_client  
+from .cache import response_cache
+from .minio_service import minio_client, url_signer, UploadTooLarge
+from .settings import settings
+from .ingest import InvalidAttachment, message_ingest
 
 router = APIRouter()
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _session_cookie_attributes() -> dict:
+    """Set and delete must agree, or browsers keep the cross-site production cookie."""
+    is_production = os.getenv("RENDER") is not None
+    return {
+        "httponly": True,
+        "secure": is_production,  # False on Localhost (HTTP), True on Render (HTTPS)
+        "samesite": "none" if is_production else "lax",  # Lax is better for local dev
+    }
+
 
 # Session Management 
 @router.post("/session/start", response_model=schemas.User)
-@limiter.limit("5/minute")
+@limiter.limit("5/minute", key="ip")
 async def start_session(
     request: Request,
     response: Response,
@@ -39,18 +58,24 @@ async def start_session(
     session_id = security.create_session_id()
     await crud.create_session(db, user_id=user.id, session_id=session_id)
 
-    # Dynamic Cookie Security
-    is_production = os.getenv("RENDER") is not None
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        secure=is_production,          # False on Localhost (HTTP), True on Render (HTTPS)
-        samesite="none" if is_production else "lax"  # Lax is better for local dev
-    )
+    response.set_cookie(key="session_id", value=session_id, **_session_cookie_attributes())
     return user
 
 
+@router.post("/session/end", status_code=status.HTTP_204_NO_CONTENT)
+async def end_session(
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    session_id = request.cookies.get("session_id")
+    await crud.delete_session(db, session_id)
+    await session_cache.invalidate_session(session_id)
+    response = Response(status_code=status.HTTP_204_NO_CONTENT)
+    response.delete_cookie("session_id", **_session_cookie_attributes())
+    return response
+
+
 @router.get("/session/me", response_model=schemas.User)
 async def read_users_me(current_user: models.User = Depends(get_current_user)):
     return current_user
@@ -64,54 +89,72 @@ async def create_room(
     current_user: models.User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    return await crud.create_room(db=db, room=room, current_user=current_user)
+    # add_user_to_room starts the owner's read cursor at the room's seq.
+    new_room = await crud.create_room(db=db, room=room, current_user=current_user)
+    await response_cache.invalidate("rooms:community")
+    return new_room
 
 
 @router.get("/rooms/community", response_model=List[schemas.PublicRoomFeedItem])
-@cache(expire=120)
-async def list_community_rooms(skip: int = 0, limit: int = 20, db: AsyncSession = Depends(get_db)):
+@response_cache.cached(
+    List[schemas.PublicRoomFeedItem],
+    ttl=120,
+    key=lambda kw: f"rooms:community:{kw['skip']}:{kw['limit']}",
+    tags=lambda kw, rooms: ["rooms:community"],
+)
+async def list_community_rooms(skip: int = 0, limit: int = 20, db: AsyncSession = Depends(get_read_db)):
     rooms = await crud.get_community_rooms(db, skip=skip, limit=limit)
-    feed = []
-    for room in rooms:
-        active_users = await services.redis_manager.get_active_users_in_room(room.id)
-        feed.append(schemas.PublicRoomFeedItem(**room.__dict__, active_users=active_users))
-    return feed
+    active_counts = await services.redis_manager.get_active_users_for_rooms([room.id for room in rooms])
+    return [
+        schemas.PublicRoomFeedItem(**room.__dict__, active_users=active_counts[room.id])
+        for room in rooms
+    ]
 
 
 @router.get("/rooms/userspaces", response_model=List[schemas.PublicRoomFeedItem])
-async def list_userspace_rooms(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+async def list_userspace_rooms(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_read_db)):
     rooms = await crud.get_userspace_rooms(db, skip=skip, limit=limit)
-    feed = []
-    for room in rooms:
-        active_users = await services.redis_manager.get_active_users_in_room(room.id)
-        feed.append(schemas.PublicRoomFeedItem(**room.__dict__, active_users=active_users))
-    return feed
+    active_counts = await services.redis_manager.get_active_users_for_rooms([room.id for room in rooms])
+    return [
+        schemas.PublicRoomFeedItem(**room.__dict__, active_users=active_counts[room.id])
+        for room in rooms
+    ]
 
 
 @router.get("/rooms/my", response_model=List[schemas.MyRoomFeedItem])
 async def list_my_rooms(
     current_user: models.User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    rooms = await crud.get_user_rooms(db, user_id=current_user.id)
+    memberships = await crud.get_user_rooms_with_membership(db, user_id=current_user.id)
+    room_ids = [room.id for room, _ in memberships]
+    active_counts, read_states = await asyncio.gather(
+        services.redis_manager.get_active_users_for_rooms(room_ids),
+        services.redis_manager.get_read_state(room_ids, current_user.id),
+    )
     feed = []
-    for room in rooms:
-        active_users = await services.redis_manager.get_active_users_in_room(room.id)
-        member_info = await crud.get_room_member(db, room_id=room.id, user_id=current_user.id)
-        unread_count = member_info.unread_count if member_info else 0
+    for room, member in memberships:
+        redis_room_seq, redis_read_seq = read_states[room.id]
         feed.append(
             schemas.MyRoomFeedItem(
                 **room.__dict__,
-                active_users=active_users,
-                unread_count=unread_count
+                active_users=active_counts[room.id],
+                unread_count=read_state.unread_count(
+                    redis_room_seq, room.message_seq, redis_read_seq, member.last_read_seq
+                )
             )
         )
     return feed
 
 
 @router.get("/rooms/{room_id}", response_model=schemas.RoomDetails)
-@cache(expire=60)
-async def get_room_details(room_id: int, db: AsyncSession = Depends(get_db)):
+@response_cache.cached(
+    schemas.RoomDetails,
+    ttl=600,
+    key=lambda kw: f"room:{kw['room_id']}:details",
+    tags=lambda kw, room: [f"room:{kw['room_id']}"],
+)
+async def get_room_details(room_id: int, db: AsyncSession = Depends(get_read_db)):
     room = await crud.get_room_with_details(db, room_id=room_id)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
@@ -132,6 +175,7 @@ async def delete_room(
     if room.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this room")
     await crud.delete_room(db, room_id=room_id)
+    await response_cache.invalidate(f"room:{room_id}", "rooms:community")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -150,6 +194,9 @@ async def join_room(
     membership = await crud.add_user_to_room(db, room_id=room_id, user_id=current_user.id)
     if not membership:
         raise HTTPException(status_code=400, detail="User is already a member of this room")
+    # The flushed room seq may lag Redis; catch the cursor up to the live one.
+    await read_state.mark_read(room_id, current_user.id)
+    await response_cache.invalidate(f"room:{room_id}")
     return {"status": "joined room successfully"}
 
 
@@ -164,12 +211,32 @@ async def leave_room(
     membership = await crud.remove_user_from_room(db, room_id=room_id, user_id=current_user.id)
     if not membership:
         raise HTTPException(status_code=404, detail="User is not a member of this room")
+    await response_cache.invalidate(f"room:{room_id}")
     return {"status": "left room successfully"}
 
 
+@router.post("/rooms/{room_id}/read", status_code=status.HTTP_200_OK)
+async def mark_room_read(
+    room_id: int,
+    mark: schemas.MarkRead,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    membership = await crud.get_room_member(db, room_id, current_user.id)
+    if not membership:
+        raise HTTPException(status_code=404, detail="User is not a member of this room")
+    last_read_seq = await read_state.mark_read(room_id, current_user.id, mark.seq, mark.message_id)
+    return {"last_read_seq": last_read_seq}
+
+
 @router.get("/rooms/{room_id}/members", response_model=List[schemas.User])
-@cache(expire=60)
-async def list_room_members(room_id: int, db: AsyncSession = Depends(get_db)):
+@response_cache.cached(
+    List[schemas.User],
+    ttl=600,
+    key=lambda kw: f"room:{kw['room_id']}:members",
+    tags=lambda kw, members: [f"room:{kw['room_id']}"],
+)
+async def list_room_members(room_id: int, db: AsyncSession = Depends(get_read_db)):
     room = await crud.get_room_with_details(db, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
@@ -179,11 +246,87 @@ async def list_room_members(room_id: int, db: AsyncSession = Depends(get_db)):
 @router.get("/rooms/{room_id}/messages", response_model=List[schemas.Message])
 async def get_room_messages(
     room_id: int,
-    skip: int = 0,
-    limit: int = 50,
-    db: AsyncSession = Depends(get_db)
+    response: Response,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=settings.HISTORY_MAX_LIMIT),
+    skip: Optional[int] = Query(None, deprecated=True, description="Use before_id / after_id instead."),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if skip is not None and before_id is None and after_id is None:
+        messages = await crud.get_messages_for_room(db, room_id=room_id, skip=skip, limit=limit)
+    else:
+        messages = await crud.get_messages_page(
+            db, room_id=room_id, limit=limit, before_id=before_id, after_id=after_id
+        )
+        # Messages are newest first; the cursor continues in the requested direction.
+        if len(messages) == limit:
+            next_cursor = messages[0].id if after_id is not None else messages[-1].id
+            response.headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    return await url_signer.attach_urls([schemas.Message.model_validate(message) for message in messages])
+
+
+def _parse_search_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    try:
+        rank, _, message_id = cursor.partition(":")
+        return float(rank), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _search_page(response: Response, rows, limit: int) -> List[schemas.MessageSearchHit]:
+    """Builds search hits and sets the next-page cursor ("<rank>:<id>") when the page is full."""
+    if len(rows) == limit:
+        last, last_rank, _ = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = f"{last_rank!r}:{last.id}"
+    return await url_signer.attach_urls([
+        schemas.MessageSearchHit(
+            **schemas.Message.model_validate(message).model_dump(), rank=rank, snippet=snippet
+        )
+        for message, rank, snippet in rows
+    ])
+
+
+@router.get("/rooms/{room_id}/messages/search", response_model=List[schemas.MessageSearchHit])
+@limiter.limit("60/minute", key="ip")
+async def search_room_messages(
+    request: Request,
+    room_id: int,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=settings.SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    return await crud.get_messages_for_room(db, room_id=room_id, skip=skip, limit=limit)
+    """Messages in one room matching `q` (web search syntax), best match first."""
+    rows = await crud.search_messages(db, q, limit=limit, room_id=room_id, cursor=_parse_search_cursor(cursor))
+    return await _search_page(response, rows, limit)
+
+
+@router.get("/messages/search", response_model=List[schemas.MessageSearchHit])
+@limiter.limit("60/minute")
+async def search_my_messages(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=settings.SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Search across every room the caller is a member of."""
+    rows = await crud.search_messages(
+        db, q, limit=limit, member_id=current_user.id, cursor=_parse_search_cursor(cursor)
+    )
+    return await _search_page(response, rows, limit)
+
+
+@router.get("/rooms/{room_id}/ws-route")
+async def get_room_ws_route(room_id: int):
+    """Which worker owns the room's WebSockets, for clients and edge proxies to route /ws/{room_id}."""
+    return shard_router.route(room_id)
 
 
 @router.get("/session/token")
@@ -200,7 +343,6 @@ async def get_session_token(request: Request, current_user: models.User = Depend
 async def websocket_endpoint(
     websocket: WebSocket,
     room_id: int,
-    db: AsyncSession = Depends(get_db),
 ):
     await websocket.accept() # Accept first to send close frame properly if needed? No, wait.
     # FastAPI usually handles auth before accept if possible, but here we need to read query/cookie.
@@ -213,47 +355,67 @@ async def websocket_endpoint(
     if not session_id:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
-    user = await crud.get_user_by_session_id(db, session_id)
+    # The socket may stay open for hours, so only hold a pooled connection
+    # for the handshake; messages and read marks open their own sessions.
+    async with AsyncSessionLocal() as db:
+        user = await resolve_session_user(db, session_id)
+        membership = await crud.get_room_member(db, room_id, user.id) if user else None
     if not user:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    membership = await crud.get_room_member(db, room_id, user.id)
     if not membership:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="User not a member of this room")
         return
 
-    await services.connection_manager.connect(websocket, room_id)
-    await services.redis_manager.add_active_user(room_id, user.id)
-
-    redis_listener_task = asyncio.create_task(
-        services.redis_manager.subscribe_to_channel(room_id, services.connection_manager)
-    )
+    if not shard_router.owns(room_id):
+        await websocket.close(code=WS_WRONG_SHARD, reason=shard_router.route(room_id)["url"])
+        return
 
+    # Streams backend only: resume from the last event this client saw.
+    last_event_id = websocket.query_params.get("last_event_id")
+    connection = await services.connection_manager.connect(websocket, room_id, replay=bool(last_event_id))
+    subscribed = joined = False
     try:
+        await services.room_dispatcher.subscribe(room_id)
+        subscribed = True
+        if last_event_id:
+            await services.room_dispatcher.replay(connection, room_id, last_event_id)
+        await presence.join(room_id, user.id)
+        joined = True
+
         while True:
-            data = await websocket.receive_text()
-            message_data = schemas.MessageCreate.model_validate_json(data)
+            data = json.loads(await websocket.receive_text())
+            if data.get("action") == "mark_read":
+                mark = schemas.MarkRead.model_validate(data)
+                await read_state.mark_read(room_id, user.id, mark.seq, mark.message_id)
+                continue
+            message_data = schemas.MessageCreate.model_validate(data)
+            metrics.WS_MESSAGES_RECEIVED.labels(metrics.room_label(room_id)).inc()
 
             if await services.is_spam(user.id, message_data.content):
                 await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Spam detected")
                 break
 
-            db_message = await crud.create_message(
-                db,
-                message=message_data,
-                room_id=room_id,
-                user_id=user.id
-            )
-            await db.refresh(db_message, attribute_names=['author'])
-
-            await services.redis_manager.publish_message(room_id, schemas.Message.from_orm(db_message))
+            try:
+                await message_ingest.submit(user, room_id, message_data)
+            except InvalidAttachment:
+                connection.enqueue(json.dumps({"type": "error", "detail": "Unknown attachment"}))
+            except Exception as exc:
+                # Commit mode: the message's batch could not be stored.
+                print(f"Message from user {user.id} in room {room_id} not saved: {exc}")
+                connection.enqueue(json.dumps({"type": "error", "detail": "Message could not be saved"}))
 
     except WebSocketDisconnect:
+        pass
+    finally:
         services.connection_manager.disconnect(websocket, room_id)
-        await services.redis_manager.remove_active_user(room_id, user.id)
-        if not redis_listener_task.done():
-            redis_listener_task.cancel()
+        try:
+            if subscribed:
+                await services.room_dispatcher.unsubscribe(room_id)
+        finally:
+            if joined:
+                await presence.leave(room_id, user.id)
 
 #  File Upload (MinIO) 
 @router.post("/upload-file")
@@ -266,16 +428,22 @@ async def upload_file(
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
 
+    # The request body was capped by UploadSizeLimit before the form was
+    # parsed; upload_stream enforces the exact limit on the file itself.
     try:
         unique_filename = f"{uuid.uuid4()}-{file.filename}"
-        file_content = await file.read()
 
-        # Upload to MinIO
-        upload_info = minio_client.upload_file(
+        # Stream to MinIO without holding the whole file in memory
+        upload_info = await minio_client.upload_stream(
             file_name=unique_filename,
-            file_data=file_content
+            file=file,
+            content_type=file.content_type
         )
+        # Messages may only attach keys handed out here, to the same user.
+        upload_info["file_key"] = security.sign_file_key(current_user.id, unique_filename)
         return upload_info
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
     except Exception as e:
         print(f"File upload failed: {e}")
         raise HTTPException(status_code=500, detail="File upload failed.")
@@ -301,10 +469,15 @@ async def generate_invite_link(
 
 
 @router.get("/invite/{token}", response_model=schemas.Room)
-@cache(expire=3600)
+@response_cache.cached(
+    schemas.Room,
+    ttl=3600,
+    key=lambda kw: f"invite:{kw['token']}",
+    tags=lambda kw, room: [f"room:{room.id}"],
+)
 async def get_room_by_invite(
     token: uuid.UUID,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     room = await crud.get_room_by_invite_token_with_owner(db, token)
     if not room:
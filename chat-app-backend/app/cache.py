@@ -0,0 +1,245 @@
+import asyncio
+import functools
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import TypeAdapter
+
+from .database import ReadSessionLocal, replica_engines
+from .services import redis_manager
+from .settings import settings
+
+# Deletes every cached response filed under the given tag sets and records
+# the generation each tag was invalidated at.
+# KEYS[1]: generation counter, KEYS[2..]: tag sets
+# ARGV[1]: seconds to remember a tag's invalidation generation
+INVALIDATE_TAGS_LUA = """
+local generation = redis.call('INCR', KEYS[1])
+for i = 2, #KEYS do
+    local keys = redis.call('SMEMBERS', KEYS[i])
+    for _, key in ipairs(keys) do
+        redis.call('DEL', key)
+    end
+    redis.call('DEL', KEYS[i])
+    redis.call('SET', KEYS[i] .. ':generation', generation, 'EX', ARGV[1])
+end
+return generation
+"""
+
+# Stores a response unless one of its tags was invalidated after the
+# generation it was computed at, i.e. while it was being computed.
+# KEYS[1]: cache key, KEYS[2..]: tag sets
+# ARGV[1]: entry, ARGV[2]: lifetime in seconds, ARGV[3]: generation
+STORE_LUA = """
+for i = 2, #KEYS do
+    if tonumber(redis.call('GET', KEYS[i] .. ':generation') or '0') > tonumber(ARGV[3]) then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+# Deletes a rebuild lock only if it still holds this caller's token, so a
+# lock that expired and was taken by another worker is left alone.
+# KEYS[1]: lock key, ARGV[1]: token
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ResponseCache:
+    """
+    Redis response cache for GET endpoints with tag-based invalidation.
+
+    Each entry is filed under tags such as ``room:{id}``; write endpoints call
+    ``invalidate()`` with the tags they affect, so TTLs only bound how long an
+    entry lives, not how stale it may be. Past its TTL an entry is served for
+    another CACHE_STALE_SECONDS while one request refreshes it in the
+    background; on a cold miss only one request per key (per worker, and
+    across workers via a Redis lock) runs the endpoint while the rest wait.
+
+    A result computed across an invalidation of one of its tags is not
+    stored: every invalidation bumps a generation counter, and the store is
+    skipped if a tag moved past the generation read before computing.
+    """
+    LOCK_SECONDS = 10
+    GENERATION_TTL_SECONDS = 3600
+    WAIT_POLL_SECONDS = 0.05
+
+    def __init__(self, prefix: str = "cache"):
+        self.prefix = prefix
+        self.stale_seconds = settings.CACHE_STALE_SECONDS
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def cached(
+        self,
+        model: Any,
+        ttl: int,
+        key: Callable[[Dict[str, Any]], str],
+        tags: Callable[[Dict[str, Any], Any], List[str]],
+    ):
+        """
+        Caches an endpoint whose result validates as `model`. `key` and `tags`
+        receive the endpoint's keyword arguments (`tags` also the result). The
+        endpoint must take its session as `db`, so a background refresh can
+        run it with a session of its own.
+        """
+        adapter = TypeAdapter(model)
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(**kwargs):
+                cache_key = f"{self.prefix}:{key(kwargs)}"
+
+                async def compute(db=None) -> Any:
+                    generation = await self._generation()
+                    call_kwargs = dict(kwargs, db=db) if db is not None else kwargs
+                    result = await func(**call_kwargs)
+                    payload = adapter.dump_python(
+                        adapter.validate_python(result, from_attributes=True), mode="json"
+                    )
+                    await self._store(cache_key, payload, ttl, tags(kwargs, result), generation)
+                    return payload
+
+                entry = await self._load(cache_key)
+                if entry is not None:
+                    if entry["fresh_until"] < time.time():
+                        asyncio.create_task(self._refresh(cache_key, compute))
+                    return entry["v"]
+                return await self._single_flight(cache_key, compute)
+
+            return wrapper
+
+        return decorator
+
+    async def invalidate(self, *tags: str):
+        if not tags:
+            return
+        await self._invalidate(tags)
+        if replica_engines:
+            # A rebuild in the meantime may have read a lagging replica.
+            asyncio.create_task(self._invalidate(tags, delay=settings.READ_YOUR_WRITES_SECONDS))
+
+    async def _invalidate(self, tags, delay: float = 0):
+        if delay:
+            await asyncio.sleep(delay)
+        script = redis_manager.script(INVALIDATE_TAGS_LUA)
+        try:
+            await script(
+                keys=[self._generation_key(), *(self._tag_key(tag) for tag in tags)],
+                args=[self.GENERATION_TTL_SECONDS],
+            )
+        except Exception as exc:
+            print(f"Cache invalidation for {tags} failed: {exc}")
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.prefix}:tag:{tag}"
+
+    def _generation_key(self) -> str:
+        return f"{self.prefix}:generation"
+
+    async def _generation(self) -> Optional[int]:
+        try:
+            return int(await redis_manager.redis_conn.get(self._generation_key()) or 0)
+        except Exception as exc:
+            print(f"Cache generation read failed: {exc}")
+            return None
+
+    async def _load(self, cache_key: str) -> Optional[dict]:
+        try:
+            raw = await redis_manager.redis_conn.get(cache_key)
+        except Exception as exc:
+            print(f"Cache read for {cache_key} failed: {exc}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def _store(self, cache_key: str, payload: Any, ttl: int, tags: List[str], generation: Optional[int]):
+        if generation is None:
+            return
+        entry = json.dumps({"v": payload, "fresh_until": time.time() + ttl})
+        script = redis_manager.script(STORE_LUA)
+        try:
+            await script(
+                keys=[cache_key, *(self._tag_key(tag) for tag in tags)],
+                args=[entry, ttl + self.stale_seconds, generation],
+            )
+        except Exception as exc:
+            print(f"Cache write for {cache_key} failed: {exc}")
+
+    async def _acquire(self, cache_key: str) -> Optional[str]:
+        """Takes the rebuild lock; returns its token, or None if another caller holds it."""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await redis_manager.redis_conn.set(f"{cache_key}:lock", token, nx=True, ex=self.LOCK_SECONDS)
+        except Exception:
+            # Without Redis there is no lock to honour; the token matches nothing.
+            return token
+        return token if acquired else None
+
+    async def _release(self, cache_key: str, token: str):
+        try:
+            await redis_manager.script(RELEASE_LOCK_LUA)(keys=[f"{cache_key}:lock"], args=[token])
+        except Exception:
+            pass
+
+    async def _refresh(self, cache_key: str, compute: Callable):
+        if cache_key in self._inflight:
+            return
+        token = await self._acquire(cache_key)
+        if token is None:
+            return
+        try:
+            async with ReadSessionLocal() as db:
+                await compute(db)
+        except Exception as exc:
+            print(f"Background refresh of {cache_key} failed: {exc}")
+        finally:
+            await self._release(cache_key, token)
+
+    async def _single_flight(self, cache_key: str, compute: Callable) -> Any:
+        inflight = self._inflight.get(cache_key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            token = await self._acquire(cache_key)
+            if token is None:
+                # Another worker is rebuilding this key; wait for it briefly.
+                deadline = time.monotonic() + self.LOCK_SECONDS
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(self.WAIT_POLL_SECONDS)
+                    entry = await self._load(cache_key)
+                    if entry is not None:
+                        future.set_result(entry["v"])
+                        return entry["v"]
+                # Still nothing: compute it here too, but the lock stays theirs.
+            try:
+                payload = await compute()
+            finally:
+                if token is not None:
+                    await self._release(cache_key, token)
+            future.set_result(payload)
+            return payload
+        except BaseException as exc:
+            if not future.done():
+                future.set_exception(exc)
+                # Nobody else may be waiting; mark the exception retrieved.
+                future.exception()
+            raise
+        finally:
+            del self._inflight[cache_key]
+
+
+response_cache = ResponseCache()
@@ -1,9 +1,13 @@
+from sqlalchemy import Float, and_, cast, func, literal, literal_column, or_, tuple_
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import selectinload, joinedload
 from . import models, schemas
+from .settings import settings
 import datetime
-from typing import List, Optional
+import html
+from typing import List, Optional, Tuple
 import uuid
 
 async def get_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
@@ -28,16 +32,27 @@ async def create_session(db: AsyncSession, user_id: int, session_id: str) -> mod
     await db.commit()
     return db_session
 
-async def get_user_by_session_id(db: AsyncSession, session_id: str) -> Optional[models.User]:
+async def get_active_session(db: AsyncSession, session_id: str) -> Optional[models.Session]:
+    """The session if it has not expired, with its user loaded."""
     query = (
         select(models.Session)
         .options(selectinload(models.Session.user))
         .filter(models.Session.id == session_id, models.Session.expires_at > datetime.datetime.utcnow())
     )
     result = await db.execute(query)
-    session = result.scalars().first()
+    return result.scalars().first()
+
+async def get_user_by_session_id(db: AsyncSession, session_id: str) -> Optional[models.User]:
+    session = await get_active_session(db, session_id)
     return session.user if session else None
 
+async def delete_session(db: AsyncSession, session_id: str) -> Optional[models.Session]:
+    db_session = await db.get(models.Session, session_id)
+    if db_session:
+        await db.delete(db_session)
+        await db.commit()
+    return db_session
+
 async def create_room(db: AsyncSession, room: schemas.RoomCreate, current_user: models.User) -> models.Room:
     is_community_room = (current_user.role == 'admin')
     db_room = models.Room(
@@ -101,6 +116,17 @@ async def get_user_rooms(db: AsyncSession, user_id: int) -> List[models.Room]:
     result = await db.execute(query)
     return result.scalars().all()
 
+async def get_user_rooms_with_membership(db: AsyncSession, user_id: int) -> List[Tuple[models.Room, models.RoomMember]]:
+    """The caller's rooms with owner and their own RoomMember row, in one joined query."""
+    query = (
+        select(models.Room, models.RoomMember)
+        .join(models.RoomMember, models.RoomMember.room_id == models.Room.id)
+        .filter(models.RoomMember.user_id == user_id)
+        .options(joinedload(models.Room.owner))
+    )
+    result = await db.execute(query)
+    return result.all()
+
 async def delete_room(db: AsyncSession, room_id: int) -> Optional[models.Room]:
     db_room = await get_room(db, room_id)
     if db_room:
@@ -114,7 +140,9 @@ async def add_user_to_room(db: AsyncSession, room_id: int, user_id: int) -> Opti
     )
     if result.scalars().first():
         return None  
-    db_membership = models.RoomMember(room_id=room_id, user_id=user_id)
+    # New members start caught up rather than with the whole history unread.
+    room_seq = select(models.Room.message_seq).filter(models.Room.id == room_id).scalar_subquery()
+    db_membership = models.RoomMember(room_id=room_id, user_id=user_id, last_read_seq=room_seq)
     db.add(db_membership)
     await db.commit()
     await db.refresh(db_membership)
@@ -136,24 +164,70 @@ async def get_room_member(db: AsyncSession, room_id: int, user_id: int) -> Optio
     )
     return result.scalars().first()
 
-async def create_message(db: AsyncSession, message: schemas.MessageCreate, room_id: int, user_id: int) -> models.Message:
+async def create_message(
+    db: AsyncSession, message: schemas.MessageCreate, room_id: int, user_id: int, seq: int
+) -> models.Message:
+    """`seq` comes from read_state.next_room_seq; history pages are ordered by it."""
     db_message = models.Message(
         content=message.content,
         type=message.type,
         file_url=message.file_url,
+        file_key=message.file_key,
         room_id=room_id, 
-        user_id=user_id
+        user_id=user_id,
+        seq=seq
     )
     db.add(db_message)
     await db.commit()
     await db.refresh(db_message)
     return db_message
 
+async def get_messages_page(
+    db: AsyncSession,
+    room_id: int,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> List[models.Message]:
+    """
+    Keyset page of a room's history, newest first. `before_id` walks back in
+    time, `after_id` catches up on newer messages; both seek on the
+    (room_id, seq, id) index so every page costs the same.
+
+    Pages follow the per-room `seq`, not the id: ids come from per-worker
+    blocks and only say which worker wrote a message, not when.
+    """
+    position = tuple_(models.Message.seq, models.Message.id)
+    query = (
+        select(models.Message)
+        .filter(models.Message.room_id == room_id)
+        .options(selectinload(models.Message.author))
+        .limit(limit)
+    )
+    if after_id is not None:
+        query = query.filter(position > _message_position(room_id, after_id))
+        result = await db.execute(query.order_by(models.Message.seq.asc(), models.Message.id.asc()))
+        return list(reversed(result.scalars().all()))
+    if before_id is not None:
+        query = query.filter(position < _message_position(room_id, before_id))
+    result = await db.execute(query.order_by(models.Message.seq.desc(), models.Message.id.desc()))
+    return result.scalars().all()
+
+def _message_position(room_id: int, message_id: int):
+    """(seq, id) of a cursor message, resolved in the same query."""
+    seq = (
+        select(models.Message.seq)
+        .filter(models.Message.id == message_id, models.Message.room_id == room_id)
+        .scalar_subquery()
+    )
+    return tuple_(seq, message_id)
+
 async def get_messages_for_room(db: AsyncSession, room_id: int, skip: int = 0, limit: int = 50) -> List[models.Message]:
+    """Offset paging, kept for old clients. Prefer get_messages_page."""
     query = (
         select(models.Message)
         .filter(models.Message.room_id == room_id)
-        .order_by(models.Message.created_at.desc())
+        .order_by(models.Message.seq.desc(), models.Message.id.desc())
         .offset(skip)
         .limit(limit)
         .options(selectinload(models.Message.author))
@@ -161,6 +235,10 @@ async def get_messages_for_room(db: AsyncSession, room_id: int, skip: int = 0, l
     result = await db.execute(query)
     return result.scalars().all()
 
+async def get_room_message_seq(db: AsyncSession, room_id: int) -> int:
+    result = await db.execute(select(models.Room.message_seq).filter(models.Room.id == room_id))
+    return result.scalars().first() or 0
+
 async def create_room_invite(db: AsyncSession, room_id: int) -> models.RoomInvite:
     db_invite = models.RoomInvite(room_id=room_id)
     db.add(db_invite)
@@ -176,4 +254,64 @@ async def get_room_by_invite_token_with_owner(db: AsyncSession, token: uuid.UUID
         .options(selectinload(models.Room.owner))
     )
     result = await db.execute(query)
-    return result.scalars().first()
\ No newline at end of file
+    return result.scalars().first()
+# Sentinels ts_headline wraps matches in; swapped for <mark> after escaping.
+_HIT_START, _HIT_STOP = "\x02", "\x03"
+
+def _snippet(text: str) -> str:
+    return html.escape(text).replace(_HIT_START, "<mark>").replace(_HIT_STOP, "</mark>")
+
+async def search_messages(
+    db: AsyncSession,
+    q: str,
+    limit: int = 20,
+    room_id: Optional[int] = None,
+    member_id: Optional[int] = None,
+    cursor: Optional[Tuple[float, int]] = None,
+) -> List[Tuple[models.Message, float, str]]:
+    """
+    Full-text search over message content, best match first, as
+    (message, rank, snippet) rows. Scoped to one room and/or to the rooms
+    `member_id` belongs to. `cursor` is the (rank, id) of the last row of
+    the previous page.
+
+    On Postgres this uses the GIN-indexed messages.content_tsv column;
+    other databases fall back to an unranked substring match.
+    """
+    if db.bind.dialect.name == "postgresql":
+        config = literal(settings.SEARCH_TEXT_CONFIG).cast(REGCONFIG)
+        tsquery = func.websearch_to_tsquery(config, q)
+        tsv = literal_column("messages.content_tsv")
+        rank = cast(func.ts_rank(tsv, tsquery), Float)
+        snippet = func.ts_headline(
+            config, models.Message.content, tsquery,
+            f"StartSel={_HIT_START}, StopSel={_HIT_STOP}, MaxFragments=2, MaxWords=24, MinWords=8",
+        )
+        match = tsv.op("@@")(tsquery)
+    else:
+        pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rank = cast(literal(0.0), Float)
+        snippet = models.Message.content
+        match = models.Message.content.ilike(pattern, escape="\\")
+
+    query = (
+        select(models.Message, rank.label("rank"), snippet.label("snippet"))
+        .filter(match)
+        .options(selectinload(models.Message.author))
+        .order_by(rank.desc(), models.Message.id.desc())
+        .limit(limit)
+    )
+    if room_id is not None:
+        query = query.filter(models.Message.room_id == room_id)
+    if member_id is not None:
+        query = query.filter(
+            models.Message.room_id.in_(
+                select(models.RoomMember.room_id).filter(models.RoomMember.user_id == member_id)
+            )
+        )
+    if cursor is not None:
+        last_rank, last_id = cursor
+        query = query.filter(or_(rank < last_rank, and_(rank == last_rank, models.Message.id < last_id)))
+
+    result = await db.execute(query)
+    return [(message, rank_value, _snippet(snippet_text)) for message, rank_value, snippet_text in result.all()]
@@ -1,12 +1,83 @@
+import itertools
+import time
+from uuid import uuid4
+
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.settings import settings
+from app.metrics import DB_POOL_CHECKOUT_SECONDS, DB_POOL_TIMEOUTS, DB_POOL_IN_USE, DB_POOL_OVERFLOW, DB_POOL_SIZE
+
+def async_database_url(url: str) -> str:
+    # Ensure we use an async driver
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+
+database_url = async_database_url(settings.DATABASE_URL)
+replica_urls = [async_database_url(url.strip()) for url in settings.DATABASE_REPLICA_URLS.split(",") if url.strip()]
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long requests wait for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+def engine_options(url: str) -> dict:
+    options = dict(
+        echo=False,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    if url.startswith("postgresql+asyncpg://"):
+        if settings.DB_PGBOUNCER_MODE:
+            # Transaction-mode poolers (PgBouncer, Supabase :6543) hand each
+            # transaction to any server connection, so prepared statements
+            # must be neither cached nor reused by name.
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            }
+        else:
+            options["connect_args"] = {
+                "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            }
+    return options
+
+
+engine = create_async_engine(database_url, **engine_options(database_url))
+AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+# Read replicas, used round-robin for read-only requests. Without any, reads
+# go to the primary.
+replica_engines = [create_async_engine(url, **engine_options(url)) for url in replica_urls]
+_replica_sessions = itertools.cycle(
+    [async_sessionmaker(e, expire_on_commit=False, class_=AsyncSession) for e in replica_engines]
+    or [AsyncSessionLocal]
+)
+
 
-database_url = settings.DATABASE_URL
-# Ensure we use an async driver
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql+asyncpg://", 1)
-elif database_url.startswith("postgresql://"):
-    database_url = database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+def ReadSessionLocal() -> AsyncSession:
+    """Opens a session on the next read replica (or the primary if none)."""
+    return next(_replica_sessions)()
 
-engine = create_async_engine(database_url, echo=False)
-AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
\ No newline at end of file
+DB_POOL_SIZE.set_function(lambda: engine.pool.size())
+DB_POOL_IN_USE.set_function(lambda: engine.pool.checkedout())
+DB_POOL_OVERFLOW.set_function(lambda: max(engine.pool.overflow(), 0))
@@ -1,12 +1,59 @@
-from fastapi import Depends, HTTPException, status, Request
+import os
+from typing import Optional
+
+from fastapi import Depends, HTTPException, status, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from . import crud, models
-from .database import AsyncSessionLocal
+from sqlalchemy.orm import make_transient_to_detached
+from . import crud, models, schemas
+from .database import AsyncSessionLocal, ReadSessionLocal, replica_engines
+from .session_cache import session_cache
+from .settings import settings
+
+# Set after a successful write so the client's next reads see it despite
+# replica lag.
+PRIMARY_PIN_COOKIE = "db_primary"
 
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
+async def get_read_db(request: Request):
+    """Session for read-only routes: a replica, unless the client just wrote."""
+    factory = AsyncSessionLocal if request.cookies.get(PRIMARY_PIN_COOKIE) else ReadSessionLocal
+    async with factory() as session:
+        yield session
+
+def pin_reads_to_primary(response: Response):
+    if not replica_engines:
+        return
+    is_production = os.getenv("RENDER") is not None
+    response.set_cookie(
+        key=PRIMARY_PIN_COOKIE,
+        value="1",
+        max_age=settings.READ_YOUR_WRITES_SECONDS,
+        httponly=True,
+        secure=is_production,
+        samesite="none" if is_production else "lax",
+    )
+
+async def resolve_session_user(db: AsyncSession, session_id: str) -> Optional[models.User]:
+    """
+    The session's user, attached to `db`. The cache holds a plain snapshot;
+    a hit is merged into `db` without a query, so relationships loaded later
+    through `db` (e.g. a new room's owner) find the user in its identity map.
+    """
+    hit, snapshot = session_cache.get(session_id)
+    if not hit:
+        session = await crud.get_active_session(db, session_id=session_id)
+        snapshot = schemas.User.model_validate(session.user) if session else None
+        session_cache.put(session_id, snapshot, expires_at=session.expires_at if session else None)
+        return session.user if session else None
+    if snapshot is None:
+        return None
+    user = models.User(**snapshot.model_dump())
+    make_transient_to_detached(user)
+    return await db.merge(user, load=False)
+
 async def get_current_user(
     request: Request, db: AsyncSession = Depends(get_db)
 ) -> models.User:
@@ -16,7 +63,7 @@ async def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
         )
-    user = await crud.get_user_by_session_id(db, session_id=session_id)
+    user = await resolve_session_user(db, session_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
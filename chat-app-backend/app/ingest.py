@@ -0,0 +1,229 @@
+import asyncio
+import datetime
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import DataError, IntegrityError
+
+from . import crud, metrics, models, read_state, schemas, security
+from .database import AsyncSessionLocal, engine
+from .settings import settings
+from .services import redis_manager
+from .minio_service import minio_client, url_signer
+
+ACK_MODES = {"publish", "commit"}
+
+
+class InvalidAttachment(Exception):
+    pass
+
+
+class MessageIdAllocator:
+    """
+    Hands out message ids from the Postgres sequence, reserving them a block
+    at a time so that assigning an id costs no round trip on the hot path.
+    """
+    def __init__(self, sequence: str, block_size: int):
+        self.sequence = sequence
+        self.block_size = block_size
+        self._ids: List[int] = []
+        self._lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        if not self._ids:
+            async with self._lock:
+                if not self._ids:
+                    await self._reserve_block()
+        return self._ids.pop()
+
+    async def _reserve_block(self):
+        query = text(f"SELECT nextval('{self.sequence}') FROM generate_series(1, :n)")
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(query, {"n": self.block_size})
+            # Reversed so that pop() hands them out in ascending order.
+            self._ids = sorted((row[0] for row in result), reverse=True)
+
+
+class MessageIngest:
+    """
+    Publishes chat messages immediately and persists them behind the scenes,
+    group-committing rows from every room in one bulk INSERT per batch. A
+    batch is flushed when it reaches MESSAGE_BATCH_SIZE rows or
+    MESSAGE_BATCH_INTERVAL_MS after its first row arrived.
+
+    MESSAGE_ACK_MODE decides when a message counts as sent: "publish" fans it
+    out before it is committed, "commit" waits for its batch to commit first.
+    Non-Postgres databases have no sequence to reserve ids from, so they fall
+    back to one synchronous insert per message.
+    """
+    MAX_FLUSH_ATTEMPTS = 3
+
+    def __init__(self):
+        if settings.MESSAGE_ACK_MODE not in ACK_MODES:
+            raise ValueError(f"Unknown MESSAGE_ACK_MODE: {settings.MESSAGE_ACK_MODE}")
+        self.ack_mode = settings.MESSAGE_ACK_MODE
+        self.batch_size = settings.MESSAGE_BATCH_SIZE
+        self.batch_interval = settings.MESSAGE_BATCH_INTERVAL_MS / 1000
+        self.write_behind = engine.dialect.name == "postgresql"
+        self.id_allocator = MessageIdAllocator(settings.MESSAGE_ID_SEQUENCE, settings.MESSAGE_ID_BLOCK_SIZE)
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.write_behind and self._flusher_task is None:
+            self._queue = asyncio.Queue()
+            self._flusher_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flusher_task is None:
+            return
+        await self._queue.put(None)
+        await self._flusher_task
+        self._flusher_task = None
+
+    async def submit(self, user: models.User, room_id: int, message: schemas.MessageCreate) -> schemas.Message:
+        message = self._store_attachment_key(user, message)
+        if message.file_key:
+            # Build the S3 client off the loop before _outgoing signs with it.
+            await minio_client.client()
+        if not self.write_behind:
+            return await self._insert_now(user, room_id, message)
+
+        row = {
+            "id": await self.id_allocator.next_id(),
+            "seq": await read_state.next_room_seq(room_id, user.id),
+            "room_id": room_id,
+            "user_id": user.id,
+            "content": message.content,
+            "type": message.type,
+            "file_url": message.file_url,
+            "file_key": message.file_key,
+            "created_at": datetime.datetime.utcnow(),
+        }
+        outgoing = self._outgoing(user, row)
+        if self.ack_mode == "publish":
+            await redis_manager.publish_message(room_id, outgoing)
+            await self._queue.put((row, None))
+        else:
+            committed = asyncio.get_running_loop().create_future()
+            await self._queue.put((row, committed))
+            await committed
+            await redis_manager.publish_message(room_id, outgoing)
+        return outgoing
+
+    async def _insert_now(self, user: models.User, room_id: int, message: schemas.MessageCreate) -> schemas.Message:
+        seq = await read_state.next_room_seq(room_id, user.id)
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            db_message = await crud.create_message(db, message=message, room_id=room_id, user_id=user.id, seq=seq)
+        metrics.MESSAGE_PERSIST_SECONDS.labels("inline").observe(time.perf_counter() - started)
+        outgoing = self._outgoing(user, {
+            column: getattr(db_message, column)
+            for column in ("id", "seq", "room_id", "content", "type", "file_url", "file_key", "created_at")
+        })
+        await redis_manager.publish_message(room_id, outgoing)
+        return outgoing
+
+    @staticmethod
+    def _store_attachment_key(user: models.User, message: schemas.MessageCreate) -> schemas.MessageCreate:
+        """
+        Persists our own attachments by object key rather than by expiring URL.
+        The key must be the signed one /upload-file gave this user; anything
+        else would have us sign URLs for arbitrary objects in the bucket.
+        """
+        if not message.file_key:
+            return message
+        file_key = security.verify_file_key(user.id, message.file_key)
+        if file_key is None:
+            raise InvalidAttachment(message.file_key)
+        return message.model_copy(update={"file_key": file_key, "file_url": None})
+
+    @staticmethod
+    def _outgoing(user: models.User, fields: Dict) -> schemas.Message:
+        outgoing = schemas.Message(
+            id=fields["id"],
+            seq=fields["seq"],
+            room_id=fields["room_id"],
+            author=schemas.User.model_validate(user),
+            content=fields["content"],
+            type=fields["type"],
+            file_url=fields["file_url"],
+            file_key=fields["file_key"],
+            created_at=fields["created_at"],
+        )
+        if outgoing.file_key:
+            outgoing.file_url = url_signer.sign(outgoing.file_key)
+        return outgoing
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch: List[Tuple[Dict, Optional[asyncio.Future]]] = [item]
+            deadline = loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Dict, Optional[asyncio.Future]]]):
+        rows = [row for row, _ in batch]
+        for attempt in range(1, self.MAX_FLUSH_ATTEMPTS + 1):
+            try:
+                started = time.perf_counter()
+                await self._insert_rows(rows)
+                metrics.MESSAGE_PERSIST_SECONDS.labels("batch").observe(time.perf_counter() - started)
+                for _, committed in batch:
+                    self._resolve(committed)
+                return
+            except (IntegrityError, DataError) as exc:
+                # A bad row fails identically on every retry; isolate it instead.
+                print(f"Message batch insert rejected: {exc}")
+                break
+            except Exception as exc:
+                print(f"Message batch insert failed (attempt {attempt}): {exc}")
+                await asyncio.sleep(0.1 * attempt)
+
+        # Insert row by row so only the rows that cannot be stored are lost.
+        dropped = 0
+        for row, committed in batch:
+            try:
+                await self._insert_rows([row])
+            except Exception as exc:
+                dropped += 1
+                print(f"Dropping message {row['id']} in room {row['room_id']}: {exc}")
+                self._resolve(committed, exc)
+            else:
+                self._resolve(committed)
+        if dropped:
+            print(f"Dropped {dropped} of {len(batch)} messages in the batch.")
+
+    @staticmethod
+    async def _insert_rows(rows: List[Dict]):
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(models.Message), rows)
+            await db.commit()
+
+    @staticmethod
+    def _resolve(committed: Optional[asyncio.Future], error: Optional[Exception] = None):
+        if committed is None or committed.done():
+            return
+        if error is None:
+            committed.set_result(None)
+        else:
+            committed.set_exception(error)
+
+message_ingest = MessageIngest()
@@ -1,4 +1,131 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import functools
+import math
+import time
+from typing import Dict, Optional, Tuple
 
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+from fastapi import HTTPException, Request, status
+
+from .services import redis_manager
+from .settings import settings
+
+RATE_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Sliding-window counter: the previous fixed window is weighted by how much
+# of it still overlaps the sliding window. Every hit is counted, including
+# rejected ones, so a client hammering past its limit stays limited.
+# KEYS: current window counter, previous window counter
+# ARGV: hits, window seconds
+SLIDING_WINDOW_LUA = """
+local current = redis.call('INCRBY', KEYS[1], ARGV[1])
+if current == tonumber(ARGV[1]) then
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]) * 2)
+end
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+return {current, previous}
+"""
+
+
+def parse_rate(spec: str) -> Tuple[int, int]:
+    """"5/minute" -> (5, 60)."""
+    count, _, unit = spec.partition("/")
+    return int(count), RATE_UNITS[unit.strip().rstrip("s")]
+
+
+def client_ip(request: Request) -> str:
+    """
+    The real client address behind RATE_LIMIT_TRUSTED_PROXY_HOPS proxies,
+    each of which appends the address it received from to X-Forwarded-For.
+    """
+    hops = settings.RATE_LIMIT_TRUSTED_PROXY_HOPS
+    forwarded = request.headers.get("x-forwarded-for")
+    if hops and forwarded:
+        addresses = [address.strip() for address in forwarded.split(",") if address.strip()]
+        if addresses:
+            return addresses[max(len(addresses) - hops, 0)]
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit_key(request: Request, key: str) -> str:
+    if key == "session":
+        session_id = request.cookies.get("session_id")
+        if session_id:
+            return f"session:{session_id}"
+    return f"ip:{client_ip(request)}"
+
+
+class SlidingWindowLimiter:
+    """
+    Rate limits shared by every worker: one atomic Lua call per check against
+    Redis. Keys that are clearly under their limit skip Redis; their hits are
+    counted locally and sent along with the next check that does go to Redis.
+    """
+    def __init__(self):
+        self.headroom = settings.RATE_LIMIT_LOCAL_HEADROOM
+        self.sync_interval = settings.RATE_LIMIT_LOCAL_SYNC_SECONDS
+        # key -> (window index, weighted count at last sync, pending local hits, synced at)
+        self._local: Dict[str, Tuple[int, float, int, float]] = {}
+
+    def limit(self, spec: str, key: str = "session"):
+        """
+        Decorates an endpoint that takes `request: Request`. `key` is "session"
+        or "ip". The session cookie is only validated by get_current_user, so
+        endpoints without it must use "ip" or a made-up cookie resets the limit.
+        """
+        limit, window = parse_rate(spec)
+
+        def decorator(func):
+            scope = f"{func.__module__}.{func.__name__}"
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request: Optional[Request] = kwargs.get("request")
+                if settings.RATE_LIMIT_ENABLED and request is not None:
+                    bucket = f"{scope}:{rate_limit_key(request, key)}"
+                    if not await self.hit(bucket, limit, window):
+                        raise HTTPException(
+                            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail=f"Rate limit exceeded: {spec}",
+                            headers={"Retry-After": str(window)},
+                        )
+                return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    async def hit(self, bucket: str, limit: int, window: int) -> bool:
+        now = time.time()
+        index = int(now // window)
+        state = self._local.get(bucket)
+        if state is not None:
+            state_index, estimate, pending, synced_at = state
+            if (
+                state_index == index
+                and now - synced_at < self.sync_interval
+                and estimate + pending + 1 <= limit * self.headroom
+            ):
+                self._local[bucket] = (index, estimate, pending + 1, synced_at)
+                return True
+            hits = pending + 1 if state_index == index else 1
+        else:
+            hits = 1
+
+        try:
+            script = redis_manager.script(SLIDING_WINDOW_LUA)
+            current, previous = await script(
+                keys=[f"rl:{bucket}:{index}", f"rl:{bucket}:{index - 1}"], args=[hits, window]
+            )
+        except Exception as exc:
+            # Fail open: a Redis outage should not take the API down with it.
+            print(f"Rate limiter unavailable: {exc}")
+            return True
+
+        elapsed = (now % window) / window
+        weighted = int(previous) * (1 - elapsed) + int(current)
+        self._local[bucket] = (index, weighted, 0, now)
+        if len(self._local) > 100000:
+            self._local.clear()
+        return math.floor(weighted) <= limit
+
+
+limiter = SlidingWindowLimiter()
@@ -0,0 +1,107 @@
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .settings import settings
+
+# Seconds; spans sub-millisecond Redis round trips up to multi-second stalls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def room_label(room_id: Optional[int]) -> str:
+    """
+    Room ids folded into METRICS_ROOM_BUCKETS label values, so per-room
+    series stay bounded however many rooms exist. 0 disables the split.
+    """
+    if room_id is None or settings.METRICS_ROOM_BUCKETS <= 0:
+        return "all"
+    return str(room_id % settings.METRICS_ROOM_BUCKETS)
+
+
+# WebSocket fan-out
+WS_OPEN_SOCKETS = Gauge(
+    "chat_ws_open_sockets",
+    "WebSockets open on this worker; sum over room for the worker total.",
+    ["room"],
+)
+WS_MESSAGES_RECEIVED = Counter(
+    "chat_ws_messages_received_total",
+    "Chat messages received from clients over WebSockets.",
+    ["room"],
+)
+WS_MESSAGES_DELIVERED = Counter(
+    "chat_ws_messages_delivered_total",
+    "Frames written to client WebSockets.",
+    ["room"],
+)
+WS_SEND_SECONDS = Histogram(
+    "chat_ws_send_seconds",
+    "Time to write one frame to one WebSocket.",
+    buckets=LATENCY_BUCKETS,
+)
+WS_FANOUT_LAG_SECONDS = Histogram(
+    "chat_ws_fanout_lag_seconds",
+    "Time from a frame arriving from Redis to its write on a client socket.",
+    buckets=LATENCY_BUCKETS,
+)
+WS_SPAM_REJECTIONS = Counter(
+    "chat_ws_spam_rejections_total",
+    "Messages rejected by the spam filter.",
+    ["reason"],
+)
+WS_SEND_QUEUE_DEPTH = Gauge(
+    "chat_ws_send_queue_depth",
+    "Frames waiting in outbound WebSocket queues, summed per room.",
+    ["room"],
+)
+WS_EVICTED_CLIENTS = Counter(
+    "chat_ws_evicted_clients_total",
+    "Clients disconnected because their outbound queue overflowed.",
+    ["room"],
+)
+WS_DROPPED_FRAMES = Counter(
+    "chat_ws_dropped_frames_total",
+    "Frames discarded for slow consumers under the drop_oldest policy.",
+    ["room"],
+)
+
+# Message persistence and Redis fan-out
+MESSAGE_PERSIST_SECONDS = Histogram(
+    "chat_message_persist_seconds",
+    "Time to write messages to the database: one row inline, or one write-behind batch.",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+MESSAGES_PUBLISHED = Counter(
+    "chat_messages_published_total",
+    "Messages published to Redis for fan-out.",
+    ["room"],
+)
+REDIS_PUBLISH_SECONDS = Histogram(
+    "chat_redis_publish_seconds",
+    "Round trip of the Redis PUBLISH / XADD that fans a message out.",
+    buckets=LATENCY_BUCKETS,
+)
+
+# Database connection pool
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "chat_db_pool_checkout_seconds",
+    "Time spent waiting for a database connection from the pool.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_TIMEOUTS = Counter(
+    "chat_db_pool_timeouts_total",
+    "Checkouts that gave up after DB_POOL_TIMEOUT_SECONDS.",
+)
+DB_POOL_SIZE = Gauge(
+    "chat_db_pool_size",
+    "Persistent connections the pool keeps open.",
+)
+DB_POOL_IN_USE = Gauge(
+    "chat_db_pool_in_use",
+    "Connections currently checked out of the pool.",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "chat_db_pool_overflow",
+    "Connections open beyond DB_POOL_SIZE.",
+)
@@ -0,0 +1,90 @@
+import asyncio
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .database import engine
+from .minio_service import minio_client
+from .models import Base, Message
+from .settings import settings
+
+# create_all only creates missing tables. Changes to tables that already
+# exist are listed here and must be safe to run on every migrate.
+SCHEMA_UPGRADES = [
+    # Superseded by ix_messages_room_id_seq; no query reads it, yet every
+    # insert into messages had to maintain it.
+    "DROP INDEX IF EXISTS ix_messages_room_id_id",
+    # History is ordered by seq. Messages from before seq existed get 0 and
+    # below, in id order, so they sort ahead of every sequenced message.
+    "UPDATE messages SET seq = ranked.legacy_seq FROM ("
+    "SELECT id, 1 - row_number() OVER (PARTITION BY room_id ORDER BY id DESC) AS legacy_seq "
+    "FROM messages WHERE seq IS NULL) AS ranked WHERE messages.id = ranked.id",
+    "CREATE INDEX IF NOT EXISTS ix_messages_room_id_seq ON messages (room_id, seq, id)",
+]
+
+# ADD COLUMN IF NOT EXISTS is Postgres syntax; other dialects get fresh tables.
+POSTGRES_UPGRADES = [
+    "ALTER TABLE rooms ADD COLUMN IF NOT EXISTS message_seq INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq INTEGER",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS file_key VARCHAR",
+    "ALTER TABLE room_members ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER",
+    "ALTER TABLE room_members ADD COLUMN IF NOT EXISTS last_read_seq INTEGER NOT NULL DEFAULT 0",
+    # Full-text search. A stored generated column is kept current by every
+    # insert and update. Adding it rewrites the table once, on first migrate.
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{settings.SEARCH_TEXT_CONFIG}', coalesce(content, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_messages_content_tsv ON messages USING GIN (content_tsv)",
+]
+
+
+async def upgrade_schema(conn: AsyncConnection):
+    await conn.run_sync(Base.metadata.create_all)
+    # Postgres first: the portable upgrades may use the columns it adds.
+    statements = POSTGRES_UPGRADES if conn.dialect.name == "postgresql" else []
+    statements = statements + SCHEMA_UPGRADES
+    for statement in statements:
+        await conn.exec_driver_sql(statement)
+    await backfill_attachment_keys(conn)
+
+
+async def backfill_attachment_keys(conn: AsyncConnection):
+    """
+    Messages from before keys were stored only kept a presigned URL, which has
+    long expired. Their key is recovered here, once, rather than trusted out
+    of arbitrary URLs every time history is read.
+    """
+    messages = Message.__table__
+    rows = await conn.execute(
+        select(messages.c.id, messages.c.file_url).where(
+            messages.c.file_key.is_(None),
+            messages.c.file_url.like(f"%/{minio_client.bucket_name}/%"),
+        )
+    )
+    keys = [
+        {"b_id": message_id, "b_key": key}
+        for message_id, url in rows
+        if (key := minio_client.key_from_url(url)) is not None
+    ]
+    if keys:
+        await conn.execute(
+            update(messages).where(messages.c.id == bindparam("b_id")).values(file_key=bindparam("b_key")),
+            keys,
+        )
+        print(f"Recovered object keys for {len(keys)} legacy attachments.")
+
+
+async def migrate():
+    """
+    Brings the database schema and the upload bucket up to date. Run by
+    `python migrate.py`, or at startup when MIGRATE_ON_STARTUP is set.
+    """
+    async def schema():
+        async with engine.begin() as conn:
+            await upgrade_schema(conn)
+        print("✅ Database tables initialized.")
+
+    async def bucket():
+        await asyncio.get_running_loop().run_in_executor(None, minio_client.initialize_bucket)
+        print("✅ MinIO bucket ready.")
+
+    await asyncio.gather(schema(), bucket())
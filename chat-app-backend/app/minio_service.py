@@ -1,9 +1,20 @@
 # minio_client 
-import boto3
-from botocore.client import Config
-from datetime import timedelta
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+from fastapi import UploadFile
 from .settings import settings
-import io
+
+
+class UploadTooLarge(Exception):
+    pass
+
 
 class MinioClient:
     def __init__(self):
@@ -13,16 +24,50 @@ class MinioClient:
         if not endpoint.startswith("http"):
             scheme = "https" if settings.MINIO_SECURE else "http"
             endpoint = f"{scheme}://{endpoint}"
+        self.endpoint = endpoint
+        self.bucket_name = settings.MINIO_BUCKET
+        # boto3 is blocking; uploads run here so the event loop keeps serving sockets.
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.UPLOAD_MAX_THREADS, thread_name_prefix="s3-upload"
+        )
+        self._s3_client = None
+        self._s3_client_lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+        """
+        boto3 takes a few hundred ms to import and set up, so the client is
+        built on first use (or by warm_up) rather than when the app is
+        imported. Building blocks; on the event loop, await `client()`.
+        """
+        if self._s3_client is None:
+            with self._s3_client_lock:
+                if self._s3_client is None:
+                    self._s3_client = self._build_s3_client()
+        return self._s3_client
 
-        self.s3_client = boto3.client(
+    def _build_s3_client(self):
+        import boto3
+        from botocore.client import Config
+
+        return boto3.client(
             "s3",
-            endpoint_url=endpoint,
+            endpoint_url=self.endpoint,
             aws_access_key_id=settings.MINIO_ACCESS_KEY,
             aws_secret_access_key=settings.MINIO_SECRET_KEY,
             config=Config(signature_version="s3v4"),
             region_name="auto" # Supabase implies region in endpoint usually
         )
-        self.bucket_name = settings.MINIO_BUCKET
+
+    async def client(self):
+        """The boto3 client, built in the executor if nothing has built it yet."""
+        if self._s3_client is not None:
+            return self._s3_client
+        return await self._run(lambda: self.s3_client)
+
+    async def warm_up(self):
+        """Builds the boto3 client off the event loop, ahead of the first upload."""
+        await self.client()
 
     def initialize_bucket(self):
         """
@@ -40,23 +85,91 @@ class MinioClient:
                 print(f"⚠️ Warning: Could not verify/create bucket '{self.bucket_name}': {e}")
                 print("   (This is expected if using Supabase with restricted permissions. Proceeding...)")
 
-    def upload_file(self, file_name: str, file_data: bytes) -> dict:
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _read_part(self, file: UploadFile, part_size: int, received: int) -> bytes:
+        part = bytearray()
+        while len(part) < part_size:
+            chunk = await file.read(min(settings.UPLOAD_CHUNK_SIZE_BYTES, part_size - len(part)))
+            if not chunk:
+                break
+            part.extend(chunk)
+            if received + len(part) > settings.UPLOAD_MAX_BYTES:
+                raise UploadTooLarge(f"Upload exceeds {settings.UPLOAD_MAX_BYTES} bytes")
+        return bytes(part)
+
+    async def upload_stream(self, file_name: str, file: UploadFile, content_type: Optional[str] = None) -> dict:
         """
-        Uploads a file to S3/MinIO and returns file_name + presigned URL.
+        Streams an upload to S3/MinIO one part at a time, so at most one part
+        is held in memory, and returns file_name + presigned URL. Files that
+        fit in a single part are sent with one PUT; larger ones use a
+        multipart upload that is aborted if anything fails, including the
+        size limit being exceeded mid-stream.
         """
-        try:
-            file_stream = io.BytesIO(file_data)
-            self.s3_client.upload_fileobj(
-                file_stream,
-                self.bucket_name,
-                file_name
+        part_size = settings.UPLOAD_PART_SIZE_BYTES
+        extra = {"ContentType": content_type} if content_type else {}
+        s3 = await self.client()
+
+        part = await self._read_part(file, part_size, 0)
+        if len(part) < part_size:
+            await self._run(
+                s3.put_object, Bucket=self.bucket_name, Key=file_name, Body=part, **extra
             )
-            # Generate presigned URL (valid 1 hr)
-            file_url = self.generate_presigned_url(file_name)
-            return {"file_name": file_name, "file_url": file_url}
-        except Exception as exc:
-            print("Error uploading file to S3:", exc)
-            raise
+        else:
+            upload = await self._run(
+                s3.create_multipart_upload, Bucket=self.bucket_name, Key=file_name, **extra
+            )
+            upload_id = upload["UploadId"]
+            parts = []
+            received = 0
+            try:
+                while part:
+                    response = await self._run(
+                        s3.upload_part,
+                        Bucket=self.bucket_name,
+                        Key=file_name,
+                        UploadId=upload_id,
+                        PartNumber=len(parts) + 1,
+                        Body=part,
+                    )
+                    parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+                    received += len(part)
+                    part = await self._read_part(file, part_size, received)
+                await self._run(
+                    s3.complete_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_name,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+            except BaseException:
+                await self._run(
+                    s3.abort_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_name,
+                    UploadId=upload_id,
+                )
+                raise
+
+        return {"file_name": file_name, "file_key": file_name, "file_url": url_signer.sign(file_name)}
+
+    def key_from_url(self, url: Optional[str]) -> Optional[str]:
+        """
+        Recovers the object key from a presigned URL for our bucket on our
+        endpoint. Only used to backfill messages stored before keys were.
+        """
+        if not url:
+            return None
+        parsed = urlparse(url)
+        if parsed.netloc != urlparse(self.endpoint).netloc or "X-Amz-Signature" not in parse_qs(parsed.query):
+            return None
+        path = parsed.path
+        marker = f"/{self.bucket_name}/"
+        if marker not in path:
+            return None
+        return unquote(path.split(marker, 1)[1]) or None
 
     def generate_presigned_url(self, file_name: str, expiry_hours: int = 1) -> str:
         """
@@ -72,4 +185,61 @@ class MinioClient:
             print("Error generating presigned URL:", exc)
             raise
 
+class PresignedUrlCache:
+    """
+    LRU of object key -> presigned GET URL. A URL is reused until
+    ATTACHMENT_URL_REFRESH_MARGIN_SECONDS before it expires, so a history page
+    full of attachments usually costs no signing at all.
+
+    Signing itself is local CPU work, but needs the boto3 client; `sign` must
+    only run once `MinioClient.client()` has been awaited, as `attach_urls` does.
+    """
+    def __init__(self, client: MinioClient, ttl: int, refresh_margin: int, max_size: int):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.max_size = max_size
+        self._urls: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def sign(self, key: str) -> str:
+        now = time.time()
+        entry = self._urls.get(key)
+        if entry is not None and entry[0] - self.refresh_margin > now:
+            self._urls.move_to_end(key)
+            return entry[1]
+        url = self.client.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.client.bucket_name, 'Key': key},
+            ExpiresIn=self.ttl
+        )
+        self._urls[key] = (now + self.ttl, url)
+        self._urls.move_to_end(key)
+        while len(self._urls) > self.max_size:
+            self._urls.popitem(last=False)
+        return url
+
+    def sign_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        return {key: self.sign(key) for key in set(keys)}
+
+    async def attach_urls(self, messages: List) -> List:
+        """
+        Fills file_url on schemas.Message objects from their object key.
+        Messages without a key keep the URL they were stored with.
+        """
+        if not any(message.file_key for message in messages):
+            return messages
+        await self.client.client()
+        urls = self.sign_many(message.file_key for message in messages if message.file_key)
+        for message in messages:
+            if message.file_key:
+                message.file_url = urls[message.file_key]
+        return messages
+
+
 minio_client = MinioClient()
+url_signer = PresignedUrlCache(
+    minio_client,
+    ttl=settings.ATTACHMENT_URL_TTL_SECONDS,
+    refresh_margin=settings.ATTACHMENT_URL_REFRESH_MARGIN_SECONDS,
+    max_size=settings.ATTACHMENT_URL_CACHE_SIZE,
+)
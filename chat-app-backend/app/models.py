@@ -1,7 +1,7 @@
 import datetime
 import uuid
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, ForeignKey
+    Column, Integer, String, Boolean, DateTime, ForeignKey, Index
 )
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.dialects.postgresql import UUID
@@ -34,6 +34,7 @@ class Room(Base):
     is_public = Column(Boolean, default=True)
     is_community = Column(Boolean, default=False, nullable=False)  # Added flag for community rooms
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    message_seq = Column(Integer, default=0, nullable=False)  # Last per-room sequence flushed from Redis
     
     owner = relationship("User", back_populates="owned_rooms")
     members = relationship("RoomMember", back_populates="room", cascade="all, delete-orphan")
@@ -45,21 +46,29 @@ class RoomMember(Base):
     id = Column(Integer, primary_key=True, index=True)
     room_id = Column(Integer, ForeignKey("rooms.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    unread_count = Column(Integer, default=0)
+    unread_count = Column(Integer, default=0)  # Unused; unread counts come from read cursors (read_state)
+    last_read_message_id = Column(Integer, nullable=True)
+    last_read_seq = Column(Integer, default=0, nullable=False)  # Read cursor, compared against Room.message_seq
     
     room = relationship("Room", back_populates="members")
     user = relationship("User", back_populates="memberships")
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset pagination: every history page is an index range scan.
+        Index("ix_messages_room_id_seq", "room_id", "seq", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     room_id = Column(Integer, ForeignKey("rooms.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     content = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    seq = Column(Integer, nullable=True)  # Per-room sequence number, drives unread counts
     
     type = Column(String, default="text")
-    file_url = Column(String, nullable=True)
+    file_url = Column(String, nullable=True)  # Legacy rows: presigned URL stored at upload time
+    file_key = Column(String, nullable=True)  # Object key; URLs are signed when messages are read
 
     room = relationship("Room", back_populates="messages")
     author = relationship("User", back_populates="messages")
@@ -0,0 +1,57 @@
+import asyncio
+from collections import Counter
+from typing import Optional
+
+from .services import redis_manager
+from .settings import settings
+
+
+class PresenceTracker:
+    """
+    Per-worker view of who is connected where. Sockets are refcounted per
+    (room, user), so a second tab keeps the user present when the first one
+    closes. All live pairs are re-announced in one pipelined heartbeat every
+    PRESENCE_HEARTBEAT_SECONDS; the same pipeline sweeps expired members.
+    """
+    def __init__(self):
+        self.interval = settings.PRESENCE_HEARTBEAT_SECONDS
+        self._refs: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+
+    async def join(self, room_id: int, user_id: int):
+        key = (room_id, user_id)
+        if not self._refs[key]:
+            # Counted only once announced, so a failed join leaves no ghost.
+            await redis_manager.touch_presence({key})
+        self._refs[key] += 1
+
+    async def leave(self, room_id: int, user_id: int):
+        key = (room_id, user_id)
+        self._refs[key] -= 1
+        if self._refs[key] > 0:
+            return
+        del self._refs[key]
+        # Tabs on other workers re-announce the user on their next heartbeat.
+        still_here = any(uid == user_id for _, uid in self._refs)
+        await redis_manager.remove_presence(room_id, user_id, everywhere=not still_here)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await redis_manager.touch_presence(set(self._refs))
+            except Exception as exc:
+                print(f"Presence heartbeat failed: {exc}")
+
+
+presence = PresenceTracker()
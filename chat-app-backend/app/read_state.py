@@ -0,0 +1,134 @@
+import asyncio
+from typing import Optional
+
+from sqlalchemy import bindparam, func, update
+
+from . import crud, models
+from .database import AsyncSessionLocal
+from .services import redis_manager
+from .settings import settings
+
+
+def unread_count(
+    redis_room_seq: Optional[int], db_room_seq: int, redis_read_seq: Optional[int], db_read_seq: int
+) -> int:
+    """
+    Unread messages are the room's sequence minus the member's read cursor.
+    Redis holds the live values and Postgres the last flushed ones; taking the
+    max of each side covers both a lagging flush and an emptied Redis.
+    """
+    room_seq = max(redis_room_seq or 0, db_room_seq or 0)
+    read_seq = max(redis_read_seq or 0, db_read_seq or 0)
+    return max(room_seq - read_seq, 0)
+
+
+async def next_room_seq(room_id: int, user_id: int) -> int:
+    seq = await redis_manager.next_room_seq(room_id, user_id)
+    if seq == 1:
+        # A fresh counter is either a brand-new room or a Redis that lost
+        # its data; in the latter case continue from the flushed value.
+        async with AsyncSessionLocal() as db:
+            flushed = await crud.get_room_message_seq(db, room_id)
+        if flushed:
+            seq = await redis_manager.advance_room_seq(room_id, flushed)
+            await redis_manager.mark_read(room_id, user_id, seq)
+    return seq
+
+
+async def mark_read(
+    room_id: int, user_id: int, seq: Optional[int] = None, message_id: Optional[int] = None
+) -> int:
+    """
+    Moves the member's read cursor up to `seq`, or to the newest message when
+    it is omitted. Receivers mark every few messages, so a given `seq` costs
+    one Redis script call that clamps it to the room's sequence, and no
+    database work; if Redis lost the room's counter it is ignored until the
+    next message restores it.
+    """
+    if seq is not None:
+        return await redis_manager.mark_read(room_id, user_id, seq, message_id)
+    room_seq = await redis_manager.get_room_seq(room_id)
+    if room_seq is None:
+        async with AsyncSessionLocal() as db:
+            room_seq = await crud.get_room_message_seq(db, room_id)
+    return await redis_manager.mark_read(room_id, user_id, fallback_room_seq=room_seq)
+
+
+class ReadStateFlusher:
+    """
+    Periodically copies room sequences and read cursors that changed in Redis
+    into Postgres, as one batched UPDATE per table. Counters only ever move
+    forward, so a late or repeated flush is harmless.
+    """
+    def __init__(self):
+        self.interval = settings.UNREAD_FLUSH_INTERVAL_SECONDS
+        self.batch_size = settings.UNREAD_FLUSH_BATCH_SIZE
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                print(f"Unread state flush failed: {exc}")
+
+    async def flush(self):
+        room_seqs = await redis_manager.pop_dirty_room_seqs(self.batch_size)
+        cursors = await redis_manager.pop_dirty_read_cursors(self.batch_size)
+        if not room_seqs and not cursors:
+            return
+        rooms = models.Room.__table__
+        members = models.RoomMember.__table__
+        try:
+            async with AsyncSessionLocal() as db:
+                if room_seqs:
+                    await db.execute(
+                        update(rooms)
+                        .where(rooms.c.id == bindparam("b_room_id"), rooms.c.message_seq < bindparam("b_seq"))
+                        .values(message_seq=bindparam("b_seq")),
+                        [{"b_room_id": room_id, "b_seq": seq} for room_id, seq in room_seqs.items()],
+                    )
+                if cursors:
+                    await db.execute(
+                        update(members)
+                        .where(
+                            members.c.room_id == bindparam("b_room_id"),
+                            members.c.user_id == bindparam("b_user_id"),
+                            members.c.last_read_seq < bindparam("b_seq"),
+                        )
+                        .values(
+                            last_read_seq=bindparam("b_seq"),
+                            last_read_message_id=func.coalesce(
+                                bindparam("b_message_id"), members.c.last_read_message_id
+                            ),
+                        ),
+                        [
+                            {"b_room_id": room_id, "b_user_id": user_id, "b_seq": seq, "b_message_id": message_id}
+                            for room_id, user_id, seq, message_id in cursors
+                        ],
+                    )
+                await db.commit()
+        except Exception:
+            await redis_manager.restore_dirty(
+                list(room_seqs), [(room_id, user_id) for room_id, user_id, _, _ in cursors]
+            )
+            raise
+
+
+read_state_flusher = ReadStateFlusher()
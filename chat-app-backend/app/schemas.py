@@ -30,7 +30,6 @@ class Room(RoomBase):
 
 class RoomMember(BaseModel):
     user: User
-    unread_count: int
     model_config = ConfigDict(from_attributes=True)
 
 class RoomDetails(Room):
@@ -39,6 +38,7 @@ class RoomDetails(Room):
 class MessageBase(BaseModel):
     content: str
     file_url: Optional[str] = None
+    file_key: Optional[str] = None
 
 class MessageCreate(MessageBase):
     type: str = "text"
@@ -49,8 +49,17 @@ class Message(MessageBase):
     author: User
     created_at: datetime.datetime
     type: str
+    seq: Optional[int] = None
     model_config = ConfigDict(from_attributes=True)
 
+class MessageSearchHit(Message):
+    rank: float
+    snippet: str  # HTML-escaped content excerpt; matches wrapped in <mark></mark>
+
+class MarkRead(BaseModel):
+    seq: Optional[int] = None  # Room sequence of the newest message seen; omit to mark everything read
+    message_id: Optional[int] = None
+
 class PublicRoomFeedItem(Room):
     active_users: int
 
@@ -1,5 +1,5 @@
 import secrets
-from itsdangerous import URLSafeTimedSerializer
+from itsdangerous import BadSignature, Signer, URLSafeTimedSerializer
 from app.settings import settings
 from typing import Optional 
 
@@ -16,4 +16,17 @@ def verify_join_token(token: str) -> Optional[int]:
         user_id = serializer.loads(token, max_age=86400)
         return user_id
     except Exception:
-        return None
\ No newline at end of file
+        return None
+
+def _file_key_signer(user_id: int) -> Signer:
+    return Signer(settings.SESSION_SECRET_KEY, salt=f"file-key:{user_id}")
+
+def sign_file_key(user_id: int, key: str) -> str:
+    """Ties an uploaded object key to its uploader, so only it can be attached."""
+    return _file_key_signer(user_id).sign(key).decode()
+
+def verify_file_key(user_id: int, signed_key: str) -> Optional[str]:
+    try:
+        return _file_key_signer(user_id).unsign(signed_key).decode()
+    except BadSignature:
+        return None
@@ -1,91 +1,794 @@
 import asyncio
-import json
+import time
+from collections import OrderedDict, deque
 import redis.asyncio as redis
-from fastapi import WebSocket
-from typing import List, Dict, Set
+from redis.commands.core import AsyncScript
+from fastapi import WebSocket, status
+from pydantic import TypeAdapter
+from typing import Callable, List, Dict, Set, Optional, Tuple
 from .settings import settings
-from . import schemas
-from .spam_filter import BLOCKED_WORDS
+from . import metrics, schemas
+from .spam_filter import BLOCKED_WORDS, BlocklistMatcher, read_blocklist_file
+
+_message_adapter = TypeAdapter(schemas.Message)
+
+
+def encode_message(message: schemas.Message) -> bytes:
+    """
+    Serializes an outgoing chat message exactly once, with pydantic-core's
+    compiled JSON encoder. The bytes go through Redis untouched and are
+    decoded once per worker into the frame shared by every local socket.
+    """
+    return _message_adapter.dump_json(message)
+
+
+def stream_id_key(event_id: str) -> Tuple[int, int]:
+    """Redis stream ids ("<ms>-<seq>") as a sortable tuple."""
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+SLOW_CONSUMER_POLICIES = {"drop_oldest", "coalesce", "disconnect"}
+
+
+class ClientConnection:
+    """
+    Outbound side of one WebSocket: a bounded queue drained by a dedicated
+    writer task, so a slow receiver never holds up the rest of its room.
+    Each queue entry is (enqueued at, list of frames); the coalesce policy
+    appends to the tail entry instead of growing the queue, and a batch of
+    several frames goes out as a single frame holding a JSON array of them.
+    """
+    def __init__(self, websocket: WebSocket, room_id: int, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.room_label = metrics.room_label(room_id)
+        self.manager = manager
+        self._pending: deque = deque()
+        self._wakeup = asyncio.Event()
+        # While a replay is being fetched, live frames are parked here so the
+        # client sees the gap first and nothing twice.
+        self._held: Optional[List[Tuple[str, Optional[str]]]] = None
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def hold(self):
+        self._held = []
+
+    def release(self, replayed: List[Tuple[str, str]]) -> bool:
+        """Queues replayed (frame, event id) pairs, then the live frames held meanwhile."""
+        held, self._held = self._held or [], None
+        last_replayed = stream_id_key(replayed[-1][1]) if replayed else None
+        for frame, _ in replayed:
+            if not self.enqueue(frame):
+                return False
+        for frame, event_id in held:
+            if last_replayed and event_id and stream_id_key(event_id) <= last_replayed:
+                continue
+            if not self.enqueue(frame):
+                return False
+        return True
+
+    def enqueue(self, frame: str, event_id: Optional[str] = None) -> bool:
+        """Queues a frame without blocking. Returns False if the client must be evicted."""
+        if self._held is not None:
+            self._held.append((frame, event_id))
+            return True
+        if len(self._pending) < self.manager.queue_size:
+            self._pending.append((time.perf_counter(), [frame]))
+            metrics.WS_SEND_QUEUE_DEPTH.labels(self.room_label).inc()
+        elif self.manager.policy == "drop_oldest":
+            _, dropped = self._pending.popleft()
+            self._pending.append((time.perf_counter(), [frame]))
+            metrics.WS_DROPPED_FRAMES.labels(self.room_label).inc(len(dropped))
+        elif self.manager.policy == "coalesce" and len(self._pending[-1][1]) < settings.WS_COALESCE_MAX_FRAMES:
+            self._pending[-1][1].append(frame)
+        else:
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self._pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                enqueued_at, batch = self._pending.popleft()
+                metrics.WS_SEND_QUEUE_DEPTH.labels(self.room_label).dec()
+                # Frames are already-encoded JSON objects, so joining them is enough.
+                frame = batch[0] if len(batch) == 1 else "[" + ",".join(batch) + "]"
+                started = time.perf_counter()
+                await self.websocket.send_text(frame)
+                sent = time.perf_counter()
+                metrics.WS_SEND_SECONDS.observe(sent - started)
+                metrics.WS_FANOUT_LAG_SECONDS.observe(sent - enqueued_at)
+                metrics.WS_MESSAGES_DELIVERED.labels(self.room_label).inc(len(batch))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; the endpoint's receive loop cleans up the rest.
+            self.manager.disconnect(self.websocket, self.room_id)
+
+    def close(self):
+        self._writer_task.cancel()
+        if self._pending:
+            metrics.WS_SEND_QUEUE_DEPTH.labels(self.room_label).dec(len(self._pending))
+            self._pending.clear()
+
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, Set[WebSocket]] = {}
+        self.active_connections: Dict[int, Dict[WebSocket, ClientConnection]] = {}
+        self.queue_size = settings.WS_SEND_QUEUE_SIZE
+        # The slow consumer policies drop from or coalesce into a queued entry.
+        if self.queue_size < 1:
+            raise ValueError(f"WS_SEND_QUEUE_SIZE must be at least 1, not {self.queue_size}")
+        self.policy = settings.WS_SLOW_CONSUMER_POLICY
+        if self.policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown WS_SLOW_CONSUMER_POLICY: {self.policy}")
 
-    async def connect(self, websocket: WebSocket, room_id: int):
-
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = set()
-        self.active_connections[room_id].add(websocket)
+    async def connect(self, websocket: WebSocket, room_id: int, replay: bool = False) -> ClientConnection:
+        connection = ClientConnection(websocket, room_id, self)
+        if replay:
+            connection.hold()
+        self.active_connections.setdefault(room_id, {})[websocket] = connection
+        metrics.WS_OPEN_SOCKETS.labels(connection.room_label).inc()
+        return connection
 
     def disconnect(self, websocket: WebSocket, room_id: int):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+        room = self.active_connections.get(room_id)
+        if room is None:
+            return
+        connection = room.pop(websocket, None)
+        if connection is not None:
+            connection.close()
+            metrics.WS_OPEN_SOCKETS.labels(connection.room_label).dec()
+        if not room:
+            del self.active_connections[room_id]
+
+    async def close_room(self, room_id: int, code: int, reason: str = ""):
+        """Closes every local socket in a room; their endpoints clean up as usual."""
+        for connection in list(self.active_connections.get(room_id, {}).values()):
+            try:
+                await connection.websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
+
+    async def broadcast_to_room(self, room_id: int, message: str, event_id: Optional[str] = None):
+        room = self.active_connections.get(room_id)
+        if not room:
+            return
+        # Snapshot: evictions and disconnects may mutate the room while we fan out.
+        for connection in list(room.values()):
+            if not connection.enqueue(message, event_id):
+                self._evict(connection)
+
+    def _evict(self, connection: ClientConnection):
+        print(f"Evicting slow consumer from room {connection.room_id}")
+        metrics.WS_EVICTED_CLIENTS.labels(connection.room_label).inc()
+        self.disconnect(connection.websocket, connection.room_id)
+        asyncio.create_task(self._close_quietly(connection.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too slow")
+        except Exception:
+            pass
+
+# Allocates the next per-room sequence number and moves the sender's read
+# cursor to it, so their own message never counts as unread.
+# KEYS: room seq, dirty rooms set, room read cursors, dirty cursors set
+# ARGV: room id, user id
+NEXT_ROOM_SEQ_LUA = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[2], seq)
+redis.call('SADD', KEYS[4], ARGV[1] .. ':' .. ARGV[2])
+return seq
+"""
+
+# Moves a member's read cursor forward: never back, and never past the
+# room's sequence, so a client cannot mark messages read before they exist.
+# KEYS: room seq, room read cursors, room read message ids, dirty cursors set
+# ARGV: user id, seq ('' for the newest), message id ('' when unknown),
+#       dirty cursor member, room seq to assume when Redis has none
+MARK_READ_LUA = """
+local room_seq = tonumber(redis.call('GET', KEYS[1]) or ARGV[5])
+local seq = room_seq
+if ARGV[2] ~= '' then
+    seq = math.min(tonumber(ARGV[2]), room_seq)
+end
+local current = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+if seq <= current then
+    return current
+end
+redis.call('HSET', KEYS[2], ARGV[1], seq)
+if ARGV[3] ~= '' and seq == tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+end
+redis.call('SADD', KEYS[4], ARGV[4])
+return seq
+"""
+
+GLOBAL_PRESENCE_KEY = "global:presence"
+DIRTY_ROOM_SEQS_KEY = "unread:dirty_rooms"
+DIRTY_READ_CURSORS_KEY = "unread:dirty_cursors"
 
-    async def broadcast_to_room(self, room_id: int, message: str):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                await connection.send_text(message)
 
 class RedisManager:
     def __init__(self):
         url = settings.REDIS_URL
         if not url.startswith("redis://") and not url.startswith("rediss://"):
              url = f"rediss://{url}"
-        self.redis_conn = redis.from_url(url, decode_responses=True)
+        self.url = url
+        # Clients are built on first use, not at import.
+        self._redis_conn: Optional[redis.Redis] = None
+        self._redis_bytes: Optional[redis.Redis] = None
+        self._scripts: Dict[str, AsyncScript] = {}
+
+    @property
+    def redis_conn(self) -> redis.Redis:
+        if self._redis_conn is None:
+            self._redis_conn = redis.from_url(self.url, decode_responses=True)
+        return self._redis_conn
+
+    @redis_conn.setter
+    def redis_conn(self, client: redis.Redis):
+        self._redis_conn = client
+        self._scripts.clear()
+
+    def script(self, source: str) -> AsyncScript:
+        """The Lua script `source` on redis_conn, registered once and run by its SHA afterwards."""
+        script = self._scripts.get(source)
+        if script is None:
+            script = self._scripts[source] = self.redis_conn.register_script(source)
+        return script
+
+    @property
+    def redis_bytes(self) -> redis.Redis:
+        # Fan-out traffic stays as bytes end to end; see encode_message.
+        if self._redis_bytes is None:
+            self._redis_bytes = redis.from_url(self.url, decode_responses=False)
+        return self._redis_bytes
+
+    @redis_bytes.setter
+    def redis_bytes(self, client: redis.Redis):
+        self._redis_bytes = client
 
     async def publish_message(self, room_id: int, message: schemas.Message):
-        channel = f"room:{room_id}"
-        await self.redis_conn.publish(channel, json.dumps(message.dict(), default=str))
+        payload = encode_message(message)
+        started = time.perf_counter()
+        if settings.FANOUT_BACKEND == "streams":
+            await self.redis_bytes.xadd(
+                f"room:{room_id}:events",
+                {"m": payload},
+                maxlen=settings.ROOM_STREAM_MAXLEN,
+                approximate=True,
+            )
+        else:
+            await self.redis_bytes.publish(f"room:{room_id}", payload)
+        metrics.REDIS_PUBLISH_SECONDS.observe(time.perf_counter() - started)
+        metrics.MESSAGES_PUBLISHED.labels(metrics.room_label(room_id)).inc()
 
-    async def subscribe_to_channel(self, room_id: int, connection_manager: ConnectionManager):
-        channel = f"room:{room_id}"
-        pubsub = self.redis_conn.pubsub()
-        await pubsub.subscribe(channel)
-        while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True)
-            if message:
-                await connection_manager.broadcast_to_room(room_id, message['data'])
-            await asyncio.sleep(0.01)
+    # Presence: sorted sets scored by each user's last heartbeat. Anyone not
+    # seen within PRESENCE_TTL_SECONDS is not counted, so a crashed worker's
+    # users age out instead of being counted forever.
 
-    async def add_active_user(self, room_id: int, user_id: int):
-        await self.redis_conn.sadd(f"room:{room_id}:active_users", user_id)
-        await self.redis_conn.sadd("global:active_users", user_id)
+    async def touch_presence(self, pairs: Set[Tuple[int, int]]):
+        """Records a heartbeat for (room id, user id) pairs and sweeps expired members, in one round trip."""
+        if not pairs:
+            return
+        now = time.time()
+        cutoff = now - settings.PRESENCE_TTL_SECONDS
+        key_ttl = int(settings.PRESENCE_TTL_SECONDS * 2)
+        rooms: Dict[int, Dict[int, float]] = {}
+        for room_id, user_id in pairs:
+            rooms.setdefault(room_id, {})[user_id] = now
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            for room_id, members in rooms.items():
+                key = f"room:{room_id}:presence"
+                pipe.zadd(key, members)
+                pipe.zremrangebyscore(key, "-inf", cutoff)
+                pipe.expire(key, key_ttl)
+            pipe.zadd(GLOBAL_PRESENCE_KEY, {user_id: now for _, user_id in pairs})
+            pipe.zremrangebyscore(GLOBAL_PRESENCE_KEY, "-inf", cutoff)
+            await pipe.execute()
 
-    async def remove_active_user(self, room_id: int, user_id: int):
-        await self.redis_conn.srem(f"room:{room_id}:active_users", user_id)
-        await self.redis_conn.srem("global:active_users", user_id)
+    async def remove_presence(self, room_id: int, user_id: int, everywhere: bool):
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            pipe.zrem(f"room:{room_id}:presence", user_id)
+            if everywhere:
+                pipe.zrem(GLOBAL_PRESENCE_KEY, user_id)
+            await pipe.execute()
 
     async def get_active_users_in_room(self, room_id: int) -> int:
-        return await self.redis_conn.scard(f"room:{room_id}:active_users")
+        return (await self.get_active_users_for_rooms([room_id]))[room_id]
+
+    async def get_active_users_for_rooms(self, room_ids: List[int]) -> Dict[int, int]:
+        """Active user counts for many rooms in a single pipelined round trip."""
+        if not room_ids:
+            return {}
+        cutoff = time.time() - settings.PRESENCE_TTL_SECONDS
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            for room_id in room_ids:
+                pipe.zcount(f"room:{room_id}:presence", cutoff, "+inf")
+            counts = await pipe.execute()
+        return dict(zip(room_ids, counts))
 
     async def get_total_active_users(self) -> int:
-        return await self.redis_conn.scard("global:active_users")
+        cutoff = time.time() - settings.PRESENCE_TTL_SECONDS
+        return await self.redis_conn.zcount(GLOBAL_PRESENCE_KEY, cutoff, "+inf")
+
+    # Unread tracking: a per-room sequence counter and per-member read
+    # cursors live in Redis and are flushed to Postgres by read_state.
+
+    async def next_room_seq(self, room_id: int, user_id: int) -> int:
+        script = self.script(NEXT_ROOM_SEQ_LUA)
+        keys = [f"room:{room_id}:seq", DIRTY_ROOM_SEQS_KEY, f"room:{room_id}:read", DIRTY_READ_CURSORS_KEY]
+        return int(await script(keys=keys, args=[room_id, user_id]))
+
+    async def advance_room_seq(self, room_id: int, amount: int) -> int:
+        return await self.redis_conn.incrby(f"room:{room_id}:seq", amount)
+
+    async def get_room_seq(self, room_id: int) -> Optional[int]:
+        value = await self.redis_conn.get(f"room:{room_id}:seq")
+        return int(value) if value is not None else None
+
+    async def mark_read(
+        self,
+        room_id: int,
+        user_id: int,
+        seq: Optional[int] = None,
+        message_id: Optional[int] = None,
+        fallback_room_seq: int = 0,
+    ) -> int:
+        """Moves the read cursor to `seq` (the newest message if None), clamped to the room seq."""
+        script = self.script(MARK_READ_LUA)
+        keys = [
+            f"room:{room_id}:seq", f"room:{room_id}:read", f"room:{room_id}:read_message", DIRTY_READ_CURSORS_KEY
+        ]
+        args = [
+            user_id,
+            seq if seq is not None else "",
+            message_id if message_id is not None else "",
+            f"{room_id}:{user_id}",
+            fallback_room_seq,
+        ]
+        return int(await script(keys=keys, args=args))
+
+    async def get_read_state(self, room_ids: List[int], user_id: int) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+        """(room seq, member read seq) per room in one round trip; None where Redis has no value."""
+        if not room_ids:
+            return {}
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            for room_id in room_ids:
+                pipe.get(f"room:{room_id}:seq")
+                pipe.hget(f"room:{room_id}:read", user_id)
+            values = await pipe.execute()
+        to_int = lambda value: int(value) if value is not None else None
+        return {
+            room_id: (to_int(values[2 * i]), to_int(values[2 * i + 1]))
+            for i, room_id in enumerate(room_ids)
+        }
+
+    async def pop_dirty_room_seqs(self, count: int) -> Dict[int, int]:
+        room_ids = [int(room_id) for room_id in await self.redis_conn.spop(DIRTY_ROOM_SEQS_KEY, count) or []]
+        if not room_ids:
+            return {}
+        seqs = await self.redis_conn.mget([f"room:{room_id}:seq" for room_id in room_ids])
+        return {room_id: int(seq) for room_id, seq in zip(room_ids, seqs) if seq is not None}
+
+    async def pop_dirty_read_cursors(self, count: int) -> List[Tuple[int, int, int, Optional[int]]]:
+        """(room id, user id, read seq, read message id) for cursors moved since the last pop."""
+        members = await self.redis_conn.spop(DIRTY_READ_CURSORS_KEY, count) or []
+        pairs = [tuple(int(part) for part in member.split(":")) for member in members]
+        if not pairs:
+            return []
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            for room_id, user_id in pairs:
+                pipe.hget(f"room:{room_id}:read", user_id)
+                pipe.hget(f"room:{room_id}:read_message", user_id)
+            values = await pipe.execute()
+        cursors = []
+        for i, (room_id, user_id) in enumerate(pairs):
+            seq, message_id = values[2 * i], values[2 * i + 1]
+            if seq is not None:
+                cursors.append((room_id, user_id, int(seq), int(message_id) if message_id is not None else None))
+        return cursors
+
+    async def restore_dirty(self, room_ids: List[int], cursors: List[Tuple[int, int]]):
+        """Puts popped entries back after a failed flush so the next run retries them."""
+        async with self.redis_conn.pipeline(transaction=False) as pipe:
+            if room_ids:
+                pipe.sadd(DIRTY_ROOM_SEQS_KEY, *room_ids)
+            if cursors:
+                pipe.sadd(DIRTY_READ_CURSORS_KEY, *(f"{room_id}:{user_id}" for room_id, user_id in cursors))
+            await pipe.execute()
+
+class RoomDispatcher:
+    """
+    Multiplexes every room channel this worker has sockets in over a single
+    Redis pub/sub connection. A room is subscribed when its first local socket
+    joins and unsubscribed when the last one leaves; each published message is
+    handed to the ConnectionManager exactly once. Other per-process channels,
+    such as auth invalidations, ride the same connection via listen().
+    """
+    def __init__(self, redis_manager: RedisManager, connection_manager: ConnectionManager):
+        self.redis_manager = redis_manager
+        self.connection_manager = connection_manager
+        self._pubsub = None
+        self._room_refs: Dict[int, int] = {}
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._lock = asyncio.Lock()
+        self._has_channels = asyncio.Event()
+        self._reader_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def channel_for(room_id: int) -> str:
+        return f"room:{room_id}"
+
+    async def subscribe(self, room_id: int):
+        async with self._lock:
+            count = self._room_refs.get(room_id, 0)
+            if count == 0:
+                await self._subscribe_channel(self.channel_for(room_id))
+            self._room_refs[room_id] = count + 1
+
+    async def listen(self, channel: str, handler: Callable[[str], None]):
+        """Subscribes this worker to a non-room channel for its whole lifetime."""
+        async with self._lock:
+            self._handlers[channel] = handler
+            await self._subscribe_channel(channel)
+
+    async def _subscribe_channel(self, channel: str):
+        if self._pubsub is None:
+            self._pubsub = self.redis_manager.redis_bytes.pubsub()
+        await self._pubsub.subscribe(channel)
+        self._has_channels.set()
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def unsubscribe(self, room_id: int):
+        async with self._lock:
+            count = self._room_refs.get(room_id, 0)
+            if count > 1:
+                self._room_refs[room_id] = count - 1
+                return
+            if count == 0:
+                return
+            del self._room_refs[room_id]
+            if not self._room_refs and not self._handlers:
+                self._has_channels.clear()
+            await self._pubsub.unsubscribe(self.channel_for(room_id))
+
+    async def _read_loop(self):
+        while True:
+            await self._has_channels.wait()
+            try:
+                # Blocks on the socket until Redis pushes something.
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"Redis pub/sub read failed, retrying: {exc}")
+                await asyncio.sleep(1)
+                continue
+            if not message or message["type"] != "message":
+                continue
+            channel = message["channel"].decode()
+            # The one decode per message; every local socket shares the frame.
+            data = message["data"].decode()
+            handler = self._handlers.get(channel)
+            if handler is not None:
+                try:
+                    handler(data)
+                except Exception as exc:
+                    print(f"Handler for {channel} failed: {exc}")
+                continue
+            room_id = int(channel.split(":", 1)[1])
+            if room_id not in self._room_refs:
+                continue
+            try:
+                await self.connection_manager.broadcast_to_room(room_id, data)
+            except Exception as exc:
+                print(f"Broadcast to room {room_id} failed: {exc}")
+
+    async def replay(self, connection: ClientConnection, room_id: int, last_event_id: str):
+        """Pub/sub keeps no history; only the live frames held meanwhile are sent."""
+        if not connection.release([]):
+            self.connection_manager._evict(connection)
+
+    async def close(self):
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+        self._room_refs.clear()
+        self._handlers.clear()
+        self._has_channels.clear()
+
+class StreamRoomDispatcher(RoomDispatcher):
+    """
+    Durable fan-out: room events are appended to a capped Redis Stream per
+    room (room:{id}:events) and read back with one blocking XREAD covering
+    every room this worker has sockets in. Frames carry their stream id as
+    event_id; a reconnecting socket passes the last one it saw and is sent
+    only the gap. Non-room channels still use pub/sub through listen().
+    """
+    def __init__(self, redis_manager: RedisManager, connection_manager: ConnectionManager):
+        super().__init__(redis_manager, connection_manager)
+        self.block_ms = settings.STREAM_READ_BLOCK_MS
+        self._last_ids: Dict[int, bytes] = {}
+        self._has_streams = asyncio.Event()
+        self._streams_changed = asyncio.Event()
+        self._stream_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def stream_for(room_id: int) -> str:
+        return f"room:{room_id}:events"
+
+    @staticmethod
+    def frame(event_id: bytes, payload: bytes) -> str:
+        # Splice the id into the already-encoded JSON object instead of re-encoding it.
+        return (b'{"event_id":"' + event_id + b'",' + payload[1:]).decode()
+
+    async def subscribe(self, room_id: int):
+        async with self._lock:
+            count = self._room_refs.get(room_id, 0)
+            if count == 0:
+                latest = await self.redis_manager.redis_bytes.xrevrange(self.stream_for(room_id), count=1)
+                self._last_ids[room_id] = latest[0][0] if latest else b"0-0"
+                self._has_streams.set()
+                self._streams_changed.set()
+            self._room_refs[room_id] = count + 1
+            if self._stream_task is None or self._stream_task.done():
+                self._stream_task = asyncio.create_task(self._stream_loop())
+
+    async def unsubscribe(self, room_id: int):
+        async with self._lock:
+            count = self._room_refs.get(room_id, 0)
+            if count > 1:
+                self._room_refs[room_id] = count - 1
+                return
+            if count == 0:
+                return
+            del self._room_refs[room_id]
+            self._last_ids.pop(room_id, None)
+            if not self._room_refs:
+                self._has_streams.clear()
+            self._streams_changed.set()
+
+    async def replay(self, connection: ClientConnection, room_id: int, last_event_id: str):
+        try:
+            entries = await self.redis_manager.redis_bytes.xrange(
+                self.stream_for(room_id), min=f"({last_event_id}", count=settings.ROOM_STREAM_MAXLEN
+            )
+        except Exception as exc:
+            print(f"Replay for room {room_id} from {last_event_id} failed: {exc}")
+            entries = []
+        replayed = [(self.frame(entry_id, fields[b"m"]), entry_id.decode()) for entry_id, fields in entries]
+        if not connection.release(replayed):
+            self.connection_manager._evict(connection)
+
+    async def _stream_loop(self):
+        while True:
+            await self._has_streams.wait()
+            self._streams_changed.clear()
+            streams = {self.stream_for(room_id): last_id for room_id, last_id in self._last_ids.items()}
+            read = asyncio.create_task(
+                self.redis_manager.redis_bytes.xread(streams, count=100, block=self.block_ms)
+            )
+            changed = asyncio.create_task(self._streams_changed.wait())
+            done, _ = await asyncio.wait({read, changed}, return_when=asyncio.FIRST_COMPLETED)
+            if read not in done:
+                # A room was added or dropped: restart the read with the new stream set.
+                read.cancel()
+                await asyncio.gather(read, return_exceptions=True)
+                continue
+            changed.cancel()
+            try:
+                response = read.result()
+            except Exception as exc:
+                print(f"Redis stream read failed, retrying: {exc}")
+                await asyncio.sleep(1)
+                continue
+            for stream, entries in response or []:
+                room_id = int(stream.split(b":")[1])
+                if room_id not in self._room_refs:
+                    continue
+                for entry_id, fields in entries:
+                    self._last_ids[room_id] = entry_id
+                    try:
+                        await self.connection_manager.broadcast_to_room(
+                            room_id, self.frame(entry_id, fields[b"m"]), entry_id.decode()
+                        )
+                    except Exception as exc:
+                        print(f"Broadcast to room {room_id} failed: {exc}")
+
+    async def close(self):
+        if self._stream_task and not self._stream_task.done():
+            self._stream_task.cancel()
+        self._last_ids.clear()
+        self._has_streams.clear()
+        await super().close()
+
+
+FANOUT_BACKENDS = {"pubsub": RoomDispatcher, "streams": StreamRoomDispatcher}
+if settings.FANOUT_BACKEND not in FANOUT_BACKENDS:
+    raise ValueError(f"Unknown FANOUT_BACKEND: {settings.FANOUT_BACKEND}")
+if settings.SPAM_RATE_LIMIT_BACKEND not in {"redis", "local"}:
+    raise ValueError(f"Unknown SPAM_RATE_LIMIT_BACKEND: {settings.SPAM_RATE_LIMIT_BACKEND}")
 
 connection_manager = ConnectionManager()
 redis_manager = RedisManager()
+room_dispatcher = FANOUT_BACKENDS[settings.FANOUT_BACKEND](redis_manager, connection_manager)
+
+SPAM_RELOAD_CHANNEL = "spam:reload"
+
+# Takes the tokens a worker granted since its last sync from a user's
+# shared bucket and returns the balance. The balance may go below zero, to
+# -capacity, when workers together granted more than the burst; the user
+# then waits the excess off before being allowed again.
+# KEYS: bucket hash; ARGV: capacity, rate, now, tokens taken
+SYNC_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+tokens = math.max(tokens - tonumber(ARGV[4]), -capacity)
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(2 * capacity / rate) + 1)
+return tostring(tokens)
+"""
+
+
+class TokenBuckets:
+    """In-process token bucket per key, bounded by evicting the least recently used key."""
+    def __init__(self, capacity: int, window_seconds: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.rate = capacity / window_seconds
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[int, Tuple[float, float]]" = OrderedDict()
+
+    async def start(self):
+        """Local buckets have nothing to sync."""
+
+    async def close(self):
+        pass
+
+    def take(self, key: int) -> bool:
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed
+
+
+class SharedTokenBuckets(TokenBuckets):
+    """
+    Token buckets checked in process and shared by every worker in batches:
+    each `sync_interval` the tokens this worker granted are taken from the
+    users' buckets in Redis, in one pipelined round trip, and the local
+    buckets are set to the shared balance. Between syncs a user can get at
+    most one extra burst per worker they reach.
+    """
+    def __init__(self, capacity: int, window_seconds: float, sync_interval: float, max_keys: int = 100000):
+        super().__init__(capacity, window_seconds, max_keys)
+        self.sync_interval = sync_interval
+        self._taken: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def take(self, key: int) -> bool:
+        allowed = super().take(key)
+        if allowed:
+            self._taken[key] = self._taken.get(key, 0) + 1
+        return allowed
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as exc:
+                # Keep limiting per worker; the tokens go out with the next sync.
+                print(f"Spam rate limit sync failed: {exc}")
+
+    async def sync(self):
+        taken, self._taken = self._taken, {}
+        if not taken:
+            return
+        now = time.time()
+        try:
+            script = redis_manager.script(SYNC_TOKEN_BUCKET_LUA)
+            async with redis_manager.redis_conn.pipeline(transaction=False) as pipe:
+                for user_id, count in taken.items():
+                    await script(
+                        keys=[f"spam_bucket:user:{user_id}"], args=[self.capacity, self.rate, now, count], client=pipe
+                    )
+                balances = await pipe.execute()
+        except Exception:
+            for user_id, count in taken.items():
+                self._taken[user_id] = self._taken.get(user_id, 0) + count
+            raise
+        synced_at = time.monotonic()
+        for user_id, balance in zip(taken, balances):
+            # Tokens granted while the sync was in flight are not in Redis yet.
+            self._buckets[user_id] = (float(balance) - self._taken.get(user_id, 0), synced_at)
+
+
+blocklist = BlocklistMatcher(
+    BLOCKED_WORDS, word_boundary=settings.SPAM_MATCH_WORD_BOUNDARY, normalize=settings.SPAM_NORMALIZE
+)
+if settings.SPAM_RATE_LIMIT_BACKEND == "redis":
+    spam_buckets = SharedTokenBuckets(
+        settings.SPAM_RATE_LIMIT_BURST,
+        settings.SPAM_RATE_LIMIT_WINDOW_SECONDS,
+        sync_interval=settings.SPAM_RATE_LIMIT_SYNC_SECONDS,
+    )
+else:
+    spam_buckets = TokenBuckets(settings.SPAM_RATE_LIMIT_BURST, settings.SPAM_RATE_LIMIT_WINDOW_SECONDS)
+
+
+async def reload_blocklist():
+    """Rebuilds the matcher from BLOCKED_WORDS plus the optional file and Redis set."""
+    global blocklist
+    words = set(BLOCKED_WORDS)
+    if settings.SPAM_BLOCKLIST_PATH:
+        words.update(read_blocklist_file(settings.SPAM_BLOCKLIST_PATH))
+    if settings.SPAM_BLOCKLIST_REDIS_KEY:
+        words.update(await redis_manager.redis_conn.smembers(settings.SPAM_BLOCKLIST_REDIS_KEY))
+    blocklist = BlocklistMatcher(
+        words, word_boundary=settings.SPAM_MATCH_WORD_BOUNDARY, normalize=settings.SPAM_NORMALIZE
+    )
+    print(f"Spam blocklist loaded: {len(blocklist)} terms.")
+
+
+async def listen_for_blocklist_reloads():
+    """Any worker can PUBLISH to SPAM_RELOAD_CHANNEL after editing the blocklist."""
+    await room_dispatcher.listen(SPAM_RELOAD_CHANNEL, lambda _: asyncio.create_task(reload_blocklist()))
+
 
 async def is_spam(user_id: int, message_content: str) -> bool:
     """
     Checks if a message is spam based on keywords or rate limiting.
     Returns True if it's spam, False otherwise.
     """
-    lower_content = message_content.lower()
-    if any(word in lower_content for word in BLOCKED_WORDS):
+    if blocklist.search(message_content):
         print(f"SPAM DETECTED: User {user_id} used a blocked keyword.")
+        metrics.WS_SPAM_REJECTIONS.labels("blocklist").inc()
         return True
 
-    redis_conn = redis_manager.redis_conn
-    rate_limit_key = f"rate_limit:user:{user_id}"
-    current_count = await redis_conn.incr(rate_limit_key)
-    if current_count == 1:
-        await redis_conn.expire(rate_limit_key, 10)
-    if current_count > 5:
+    if not spam_buckets.take(user_id):
         print(f"SPAM DETECTED: User {user_id} exceeded rate limit.")
+        metrics.WS_SPAM_REJECTIONS.labels("rate_limit").inc()
         return True
 
     return False
-
-
-
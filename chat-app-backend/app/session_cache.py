@@ -0,0 +1,71 @@
+import datetime
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from . import schemas
+from .services import redis_manager, room_dispatcher
+from .settings import settings
+
+AUTH_INVALIDATION_CHANNEL = "auth:invalidate"
+
+
+class SessionCache:
+    """
+    Bounded in-process LRU of session id -> user snapshot with a TTL per
+    entry. Snapshots are plain schemas.User values, never ORM instances,
+    so no entry is tied to the session that loaded it.
+    Unknown or expired session ids are cached as None for a shorter TTL so a
+    client retrying a dead cookie does not hit the database every time, and
+    no entry outlives its session. Ended sessions are dropped on every worker
+    through AUTH_INVALIDATION_CHANNEL.
+    """
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[schemas.User]]]" = OrderedDict()
+
+    def get(self, session_id: str) -> Tuple[bool, Optional[schemas.User]]:
+        """Returns (hit, user); a hit with user None is a cached invalid session."""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return False, None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[session_id]
+            return False, None
+        self._entries.move_to_end(session_id)
+        return True, user
+
+    def put(self, session_id: str, user: Optional[schemas.User], expires_at: Optional[datetime.datetime] = None):
+        """`expires_at` is the session's naive UTC expiry, as stored in sessions.expires_at."""
+        ttl = self.ttl if user is not None else self.negative_ttl
+        if expires_at is not None:
+            ttl = min(ttl, (expires_at - datetime.datetime.utcnow()).total_seconds())
+        self._entries[session_id] = (time.monotonic() + ttl, user)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def drop_session(self, session_id: str):
+        self._entries.pop(session_id, None)
+
+    def handle_invalidation(self, data: str):
+        kind, _, value = data.partition(":")
+        if kind == "session":
+            self.drop_session(value)
+
+    async def listen(self):
+        await room_dispatcher.listen(AUTH_INVALIDATION_CHANNEL, self.handle_invalidation)
+
+    async def invalidate_session(self, session_id: str):
+        self.drop_session(session_id)
+        await redis_manager.redis_conn.publish(AUTH_INVALIDATION_CHANNEL, f"session:{session_id}")
+
+
+session_cache = SessionCache(
+    max_size=settings.SESSION_CACHE_SIZE,
+    ttl=settings.SESSION_CACHE_TTL_SECONDS,
+    negative_ttl=settings.SESSION_CACHE_NEGATIVE_TTL_SECONDS,
+)
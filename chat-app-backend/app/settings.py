@@ -5,6 +5,24 @@ class Settings(BaseSettings):
     REDIS_URL: str
     SESSION_SECRET_KEY: str
 
+    MIGRATE_ON_STARTUP: bool = False  # Otherwise run `python migrate.py` on deploy
+
+    # Comma-separated read replica URLs; read-only endpoints are balanced across them
+    DATABASE_REPLICA_URLS: str = ""
+    READ_YOUR_WRITES_SECONDS: int = 5  # Reads stay on the primary this long after a client's write
+
+    # Prometheus
+    METRICS_ROOM_BUCKETS: int = 64  # Per-room metrics use room_id % this as the label; 0 for none
+
+    # Database connection pool
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 10.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800  # Below typical server/LB idle timeouts
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100  # Prepared statements cached per asyncpg connection
+    DB_PGBOUNCER_MODE: bool = False  # Disable prepared statement caching for transaction-mode poolers
+
     # MinIO Sett
     MINIO_ENDPOINT: str
     MINIO_ACCESS_KEY: str
@@ -12,6 +30,84 @@ class Settings(BaseSettings):
     MINIO_BUCKET: str = "chat-files"
     MINIO_SECURE: bool = False
 
+    # Uploads
+    UPLOAD_MAX_BYTES: int = 50 * 1024 * 1024
+    UPLOAD_PART_SIZE_BYTES: int = 8 * 1024 * 1024  # S3 requires >= 5 MiB for all but the last part
+    UPLOAD_CHUNK_SIZE_BYTES: int = 1024 * 1024
+    UPLOAD_MAX_THREADS: int = 4
+
+    # Attachment URLs are signed when read and reused until shortly before expiry
+    ATTACHMENT_URL_TTL_SECONDS: int = 6 * 3600
+    ATTACHMENT_URL_REFRESH_MARGIN_SECONDS: int = 300
+    ATTACHMENT_URL_CACHE_SIZE: int = 10000
+
+    # WebSocket fan-out
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"  # drop_oldest | coalesce | disconnect
+    WS_COALESCE_MAX_FRAMES: int = 64  # Coalesced frames are sent as one JSON array
+    FANOUT_BACKEND: str = "pubsub"  # pubsub | streams
+    ROOM_STREAM_MAXLEN: int = 1000
+    STREAM_READ_BLOCK_MS: int = 5000
+
+    # Room-affinity sharding of WebSocket connections
+    WS_SHARDING_ENABLED: bool = False
+    WORKER_ID: str = ""  # Defaults to hostname:pid
+    WORKER_PUBLIC_URL: str = ""  # Base URL clients use to reach this worker, e.g. wss://chat-3.example.com
+    SHARD_VIRTUAL_NODES: int = 100
+    SHARD_HEARTBEAT_SECONDS: float = 5.0
+    SHARD_WORKER_TTL_SECONDS: float = 15.0
+
+    # Message ingest (write-behind persistence)
+    MESSAGE_ACK_MODE: str = "publish"  # publish | commit
+    MESSAGE_BATCH_SIZE: int = 500
+    MESSAGE_BATCH_INTERVAL_MS: int = 20
+    MESSAGE_ID_BLOCK_SIZE: int = 100
+    MESSAGE_ID_SEQUENCE: str = "messages_id_seq"
+
+    # Message history
+    HISTORY_MAX_LIMIT: int = 100  # Largest page GET /rooms/{id}/messages returns
+
+    # HTTP rate limiting
+    RATE_LIMIT_ENABLED: bool = True
+    # Proxies in front of the app that append to X-Forwarded-For (1 on Render).
+    # With 0 the header is ignored, so clients cannot pick their own address.
+    RATE_LIMIT_TRUSTED_PROXY_HOPS: int = 0
+    RATE_LIMIT_LOCAL_HEADROOM: float = 0.5  # Skip Redis while a key is under this share of its limit
+    RATE_LIMIT_LOCAL_SYNC_SECONDS: float = 1.0
+
+    # Response cache
+    CACHE_STALE_SECONDS: int = 60  # Served stale for this long past TTL while one request refreshes
+
+    # Session -> user cache
+    SESSION_CACHE_SIZE: int = 10000
+    SESSION_CACHE_TTL_SECONDS: float = 60.0
+    SESSION_CACHE_NEGATIVE_TTL_SECONDS: float = 5.0
+
+    # Presence
+    PRESENCE_HEARTBEAT_SECONDS: float = 15.0
+    PRESENCE_TTL_SECONDS: float = 45.0
+
+    # Spam filter
+    SPAM_BLOCKLIST_PATH: str = ""  # Extra terms, one per line
+    SPAM_BLOCKLIST_REDIS_KEY: str = "spam:blocked_words"  # Extra terms in a Redis set
+    SPAM_MATCH_WORD_BOUNDARY: bool = False
+    SPAM_NORMALIZE: bool = True
+    # Each user's budget is checked in process. redis also syncs it across
+    # workers every SPAM_RATE_LIMIT_SYNC_SECONDS, so a user gets at most one
+    # extra burst per worker between syncs; local never syncs.
+    SPAM_RATE_LIMIT_BACKEND: str = "redis"  # redis | local
+    SPAM_RATE_LIMIT_BURST: int = 5
+    SPAM_RATE_LIMIT_WINDOW_SECONDS: float = 10.0
+    SPAM_RATE_LIMIT_SYNC_SECONDS: float = 1.0
+
+    # Unread counts
+    UNREAD_FLUSH_INTERVAL_SECONDS: float = 5.0
+    UNREAD_FLUSH_BATCH_SIZE: int = 1000
+
+    # Message search (Postgres full-text)
+    SEARCH_TEXT_CONFIG: str = "simple"  # Baked into messages.content_tsv; changing it means rebuilding the column
+    SEARCH_MAX_LIMIT: int = 50
+
     model_config = SettingsConfigDict(env_file=".env")
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,112 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .services import connection_manager, redis_manager
+from .settings import settings
+
+WORKERS_KEY = "shard:workers"
+WORKER_URLS_KEY = "shard:worker_urls"
+
+# Close code telling the client to reconnect to the worker named in the reason.
+WS_WRONG_SHARD = 4307
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes, so adding a worker only moves ~1/N of the rooms."""
+    def __init__(self, nodes: List[str], virtual_nodes: int):
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._nodes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class ShardRouter:
+    """
+    Places every room on exactly one worker so that a hot room is fanned out
+    by one process instead of by every worker holding one of its sockets.
+
+    Workers heartbeat into a Redis sorted set; the ring is rebuilt from the
+    live members on each beat. When membership changes, local sockets of
+    rooms that moved are closed with WS_WRONG_SHARD and the new owner's URL,
+    and clients reconnect there.
+    """
+    def __init__(self):
+        self.enabled = settings.WS_SHARDING_ENABLED
+        self.worker_id = settings.WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
+        self.public_url = settings.WORKER_PUBLIC_URL
+        self._workers: Tuple[str, ...] = (self.worker_id,)
+        self._urls: Dict[str, str] = {self.worker_id: self.public_url}
+        self._ring = HashRing(list(self._workers), settings.SHARD_VIRTUAL_NODES)
+        self._task: Optional[asyncio.Task] = None
+
+    def owner(self, room_id: int) -> str:
+        return self._ring.owner(f"room:{room_id}") or self.worker_id
+
+    def owns(self, room_id: int) -> bool:
+        return not self.enabled or self.owner(room_id) == self.worker_id
+
+    def route(self, room_id: int) -> dict:
+        owner = self.owner(room_id) if self.enabled else self.worker_id
+        return {"worker": owner, "url": self._urls.get(owner, "")}
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            await self.heartbeat()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        await redis_manager.redis_conn.zrem(WORKERS_KEY, self.worker_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.SHARD_HEARTBEAT_SECONDS)
+            try:
+                await self.heartbeat()
+            except Exception as exc:
+                print(f"Shard heartbeat failed: {exc}")
+
+    async def heartbeat(self):
+        now = time.time()
+        async with redis_manager.redis_conn.pipeline(transaction=False) as pipe:
+            pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+            pipe.hset(WORKER_URLS_KEY, self.worker_id, self.public_url)
+            pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - settings.SHARD_WORKER_TTL_SECONDS)
+            pipe.zrange(WORKERS_KEY, 0, -1)
+            pipe.hgetall(WORKER_URLS_KEY)
+            *_, workers, urls = await pipe.execute()
+        workers = tuple(sorted(workers))
+        self._urls = urls
+        if workers != self._workers:
+            print(f"Shard membership changed: {len(self._workers)} -> {len(workers)} workers")
+            self._workers = workers
+            self._ring = HashRing(list(workers), settings.SHARD_VIRTUAL_NODES)
+            await self.rebalance()
+
+    async def rebalance(self):
+        for room_id in list(connection_manager.active_connections):
+            if not self.owns(room_id):
+                route = self.route(room_id)
+                await connection_manager.close_room(room_id, WS_WRONG_SHARD, route["url"])
+
+
+shard_router = ShardRouter()
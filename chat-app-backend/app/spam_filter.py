@@ -1,8 +1,99 @@
 # wordblkd
 
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
 BLOCKED_WORDS = {
     "spam",
     "promo",
     "unwanted-ad",
     # Add 
-}
\ No newline at end of file
+}
+
+
+def normalize_text(text: str) -> str:
+    """Case-folds, applies NFKC and strips accents so look-alike spellings match."""
+    decomposed = unicodedata.normalize("NFKD", unicodedata.normalize("NFKC", text).casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+class BlocklistMatcher:
+    """
+    Aho-Corasick automaton over the blocklist: one pass over the message
+    finds any of the terms, however many there are. Built once and then
+    only read, so a reload swaps in a new instance.
+    """
+    def __init__(self, words: Iterable[str], word_boundary: bool = False, normalize: bool = True):
+        self.word_boundary = word_boundary
+        self.normalize = normalize
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]
+        # Longest term ending at each state, following failure links.
+        self._outputs: List[List[str]] = [[]]
+        for word in words:
+            self._add(self._prepare(word.strip()))
+        self._build()
+
+    def __len__(self) -> int:
+        return sum(1 for word in self._output if word)
+
+    def _prepare(self, text: str) -> str:
+        return normalize_text(text) if self.normalize else text.lower()
+
+    def _add(self, word: str):
+        if not word:
+            return
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._outputs.append([])
+            state = nxt
+        self._output[state] = word
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            own = [self._output[state]] if self._output[state] else []
+            self._outputs[state] = own + self._outputs[self._fail[state]]
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+
+    def search(self, text: str) -> Optional[str]:
+        """Returns the first blocked term found in `text`, or None."""
+        text = self._prepare(text)
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for word in outputs[state]:
+                if not self.word_boundary or self._at_boundary(text, index - len(word) + 1, index + 1):
+                    return word
+        return None
+
+    @staticmethod
+    def _at_boundary(text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not before.isalnum() and not after.isalnum()
+
+
+def read_blocklist_file(path: str) -> List[str]:
+    """One term per line; blank lines and lines starting with # are ignored."""
+    with open(path, encoding="utf-8") as handle:
+        return [line.strip() for line in handle if line.strip() and not line.startswith("#")]
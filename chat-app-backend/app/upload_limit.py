@@ -0,0 +1,73 @@
+from typing import Collection
+
+# Room for the multipart boundaries and part headers around the file itself.
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware that caps request bodies on the given paths before the
+    multipart form is parsed and spooled to disk. A declared Content-Length
+    over the cap is refused without reading the body; otherwise bytes are
+    counted as they stream in and the request is cut off with 413 as soon as
+    the cap is passed, whatever the header claimed.
+    """
+    def __init__(self, app, paths: Collection[str], max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise BodyTooLarge(f"Request body exceeds {self.max_bytes} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal rejected
+            # FastAPI turns a failed form parse into a 400; answer 413 instead.
+            if exceeded:
+                if not rejected and message["type"] == "http.response.start":
+                    rejected = True
+                    await self._reject(send)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except BodyTooLarge:
+            if not rejected:
+                rejected = True
+                await self._reject(send)
+
+    @staticmethod
+    async def _reject(send):
+        body = b'{"detail":"File too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,39 @@
+import pytest
+
+from app import crud, read_state, schemas
+
+from conftest import SESSION_ID
+
+pytestmark = pytest.mark.benchmark(group="crud")
+
+
+def bench_create_message(benchmark, run, seeded, db):
+    user, room = seeded
+    message = schemas.MessageCreate(content="hello from the benchmark")
+
+    async def create():
+        # As on the commit-mode write path: allocate the room seq, then insert.
+        seq = await read_state.next_room_seq(room.id, user.id)
+        await crud.create_message(db, message, room.id, user.id, seq=seq)
+
+    benchmark(run, create)
+
+
+def bench_get_messages_for_room(benchmark, run, seeded, db):
+    _, room = seeded
+    benchmark(run, crud.get_messages_for_room, db, room.id, 0, 50)
+
+
+def bench_get_messages_for_room_deep_offset(benchmark, run, seeded, db):
+    _, room = seeded
+    benchmark(run, crud.get_messages_for_room, db, room.id, 1500, 50)
+
+
+def bench_get_messages_page(benchmark, run, seeded, db):
+    _, room = seeded
+    benchmark(run, crud.get_messages_page, db, room.id, 50, 500)
+
+
+def bench_get_user_by_session_id(benchmark, run, seeded, db):
+    user = benchmark(run, crud.get_user_by_session_id, db, SESSION_ID)
+    assert user is not None
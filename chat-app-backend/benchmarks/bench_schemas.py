@@ -0,0 +1,20 @@
+import pytest
+
+from app import crud, schemas, services
+
+pytestmark = pytest.mark.benchmark(group="schemas")
+
+
+@pytest.fixture
+def page(run, seeded, db):
+    _, room = seeded
+    return run(crud.get_messages_page, db, room.id, 50)
+
+
+def bench_message_validate(benchmark, page):
+    benchmark(lambda: [schemas.Message.model_validate(message) for message in page])
+
+
+def bench_message_encode(benchmark, page):
+    messages = [schemas.Message.model_validate(message) for message in page]
+    benchmark(lambda: [services.encode_message(message) for message in messages])
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app import services
+
+pytestmark = pytest.mark.benchmark(group="services")
+
+CLEAN_TEXT = "Anyone around for the standup? I pushed the fix for the upload retries. " * 4
+SPAM_TEXT = CLEAN_TEXT + " promo"
+
+
+class FakeSocket:
+    """Accepts frames like a WebSocket with an instant network."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_text(self, frame: str):
+        self.sent += 1
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+@pytest.fixture(scope="module", autouse=True)
+def blocklist(run):
+    run(services.reload_blocklist)
+
+
+def bench_is_spam_clean(benchmark, run):
+    assert not benchmark(run, services.is_spam, 1, CLEAN_TEXT)
+
+
+def bench_is_spam_blocked(benchmark, run):
+    assert benchmark(run, services.is_spam, 1, SPAM_TEXT)
+
+
+@pytest.mark.parametrize("room_size", [10, 100, 1000])
+def bench_broadcast_to_room(benchmark, run, room_size):
+    manager = services.ConnectionManager()
+    room_id = 1
+    sockets = [FakeSocket() for _ in range(room_size)]
+
+    async def connect():
+        for socket in sockets:
+            await manager.connect(socket, room_id)
+
+    async def broadcast():
+        # Includes draining every writer queue, i.e. until all sockets got the frame.
+        await manager.broadcast_to_room(room_id, '{"content": "hi"}')
+        while any(connection.depth for connection in manager.active_connections[room_id].values()):
+            await asyncio.sleep(0)
+
+    run(connect)
+    benchmark(run, broadcast)
+    assert all(socket.sent for socket in sockets)
+
+    async def disconnect():
+        for socket in sockets:
+            manager.disconnect(socket, room_id)
+        await asyncio.sleep(0)
+
+    run(disconnect)
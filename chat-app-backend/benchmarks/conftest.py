@@ -0,0 +1,46 @@
+import datetime
+import os
+
+import pytest
+
+if os.getenv("BENCH_DATABASE_URL"):
+    os.environ["TEST_DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+# Keep is_spam on its normal path instead of tripping the per-user limit.
+os.environ["SPAM_RATE_LIMIT_BURST"] = str(10 ** 9)
+
+from tests.support import add_room_with_member, loop, reset_schema, run  # noqa: E402,F401
+from app import models  # noqa: E402
+from app.database import AsyncSessionLocal  # noqa: E402
+
+SEED_MESSAGES = 2000
+SESSION_ID = "bench-session"
+
+
+@pytest.fixture(scope="session")
+def seeded(run):
+    """A user with a session and a room holding SEED_MESSAGES messages."""
+    async def seed():
+        await reset_schema()
+        async with AsyncSessionLocal() as db:
+            user, room = await add_room_with_member(db, "bench")
+            room.message_seq = SEED_MESSAGES  # New messages continue after the seeded ones
+            db.add(models.Session(
+                id=SESSION_ID,
+                user_id=user.id,
+                expires_at=datetime.datetime.utcnow() + datetime.timedelta(days=1),
+            ))
+            db.add_all(
+                models.Message(content=f"message {i}", room_id=room.id, user_id=user.id, seq=i + 1)
+                for i in range(SEED_MESSAGES)
+            )
+            await db.commit()
+            return user, room
+
+    return run(seed)
+
+
+@pytest.fixture
+def db(run):
+    session = AsyncSessionLocal()
+    yield session
+    run(session.close)
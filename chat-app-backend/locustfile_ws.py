@@ -0,0 +1,188 @@
+"""
+WebSocket load test: end-to-end fan-out latency by room size.
+
+Each simulated user starts a session, creates or joins a room, fetches a
+WebSocket token and keeps a socket open. A share of the users (the senders)
+post messages stamped with their send time; every member that receives one
+reports the publish-to-deliver latency to Locust as a "WS fanout room=<size>"
+request, so the Locust stats and CSV output give p50/p95/p99 per room size.
+
+Run the backend against the local containers, with HTTP rate limiting off so
+session starts from one IP are not throttled:
+
+    docker compose up -d db redis minio
+    RATE_LIMIT_ENABLED=false uvicorn main:app --port 8000
+    locust -f locustfile_ws.py --host http://localhost:8000 \
+        --users 500 --spawn-rate 50 --run-time 5m --headless --csv ws
+
+Tuning (environment variables):
+
+    WS_ROOM_SIZES     room size:weight pairs, default "2:5,10:3,50:2"
+    WS_SENDER_RATIO   share of users that send, default 0.2
+    WS_SEND_INTERVAL  seconds between a sender's messages, default 3
+                      (stay above SPAM_RATE_LIMIT_WINDOW_SECONDS /
+                      SPAM_RATE_LIMIT_BURST or senders get disconnected)
+
+Latency uses wall-clock send and receive times, so run all Locust workers on
+one host (or hosts with synchronised clocks). Rooms are filled per Locust
+process; in distributed mode each worker fills its own rooms.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import gevent
+import gevent.event
+import websocket
+from locust import HttpUser, between, events, task
+
+ROOM_SIZES = [
+    (int(size), float(weight))
+    for size, weight in (pair.split(":") for pair in os.getenv("WS_ROOM_SIZES", "2:5,10:3,50:2").split(","))
+]
+SENDER_RATIO = float(os.getenv("WS_SENDER_RATIO", "0.2"))
+SEND_INTERVAL = float(os.getenv("WS_SEND_INTERVAL", "3"))
+MESSAGE_PREFIX = "loadtest"
+
+
+class RoomAllocator:
+    """Hands out room seats so rooms fill up to sizes drawn from WS_ROOM_SIZES."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = []
+
+    def take_seat(self):
+        """
+        Returns (room, size, is_creator). The creator must call `created()`
+        with the room id; other members wait for it in `room_id()`.
+        """
+        with self._lock:
+            for room in self._open:
+                if room["taken"] < room["size"]:
+                    room["taken"] += 1
+                    return room, room["size"], False
+            sizes, weights = zip(*ROOM_SIZES)
+            room = {
+                "id": None,
+                "size": random.choices(sizes, weights)[0],
+                "taken": 1,
+                "ready": gevent.event.Event(),
+            }
+            self._open.append(room)
+            return room, room["size"], True
+
+    def created(self, room, room_id):
+        room["id"] = room_id
+        if room_id is None:
+            # Creation failed; stop seating users in this room.
+            room["taken"] = room["size"]
+        room["ready"].set()
+
+    def room_id(self, room, timeout: float = 60):
+        room["ready"].wait(timeout)
+        return room["id"]
+
+
+rooms = RoomAllocator()
+
+
+class ChatSocketUser(HttpUser):
+    wait_time = between(SEND_INTERVAL * 0.8, SEND_INTERVAL * 1.2)
+
+    def on_start(self):
+        self.name = f"ws_loadtest_{uuid.uuid4().hex[:12]}"
+        self.is_sender = random.random() < SENDER_RATIO
+        self.ws = None
+
+        if not self.client.post("/api/v1/session/start", json={"name": self.name}).ok:
+            return
+        seat, self.room_size, is_creator = rooms.take_seat()
+        if is_creator:
+            response = self.client.post("/api/v1/rooms", json={"name": f"{self.name}_room", "is_public": True})
+            rooms.created(seat, response.json()["id"] if response.ok else None)
+            self.room_id = seat["id"]
+        else:
+            self.room_id = rooms.room_id(seat)
+            if self.room_id is not None:
+                self.client.post(f"/api/v1/rooms/{self.room_id}/join", name="/api/v1/rooms/[id]/join")
+        if self.room_id is None:
+            return
+
+        token = self.client.get("/api/v1/session/token").json()["token"]
+        ws_url = self.host.replace("http", "ws", 1) + f"/api/v1/ws/{self.room_id}?token={token}"
+        started = time.perf_counter()
+        try:
+            self.ws = websocket.create_connection(ws_url, timeout=30)
+        except Exception as exc:
+            self._report("connect", started, exception=exc)
+            return
+        # The timeout is for the handshake only; receivers in rooms without a
+        # sender can sit idle for the whole run.
+        self.ws.settimeout(None)
+        self._report("connect", started)
+        self.receiver = gevent.spawn(self._receive_loop)
+
+    def on_stop(self):
+        self._drop()
+
+    def _drop(self):
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            ws.close()
+
+    @task
+    def send_message(self):
+        if self.ws is None or not self.is_sender:
+            return
+        content = f"{MESSAGE_PREFIX} {self.name} {time.time():.6f}"
+        started = time.perf_counter()
+        try:
+            self.ws.send(json.dumps({"content": content, "type": "text"}))
+        except Exception as exc:
+            self._report("send", started, exception=exc)
+            self._drop()
+            return
+        self._report("send", started)
+
+    def _receive_loop(self):
+        ws = self.ws
+        while ws is not None and ws.connected:
+            try:
+                frame = ws.recv()
+            except Exception as exc:
+                if self.ws is ws:
+                    self._report("disconnect", time.perf_counter(), exception=exc)
+                    self._drop()
+                return
+            received = time.time()
+            try:
+                messages = json.loads(frame)
+            except ValueError:
+                continue
+            # The coalesce policy batches messages for slow receivers into an array.
+            for message in messages if isinstance(messages, list) else [messages]:
+                parts = message.get("content", "").split(" ")
+                if len(parts) != 3 or parts[0] != MESSAGE_PREFIX:
+                    continue
+                events.request.fire(
+                    request_type="WS",
+                    name=f"fanout room={self.room_size}",
+                    response_time=(received - float(parts[2])) * 1000,
+                    response_length=len(frame),
+                    exception=None,
+                    context={},
+                )
+
+    def _report(self, name: str, started: float, exception: Exception = None):
+        events.request.fire(
+            request_type="WS",
+            name=f"{name} room={self.room_size}",
+            response_time=(time.perf_counter() - started) * 1000,
+            response_length=0,
+            exception=exception,
+            context={},
+        )
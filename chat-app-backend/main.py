@@ -103,31 +103,62 @@
 
 
 from prometheus_fastapi_instrumentator import Instrumentator
+import asyncio
 import uvicorn
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from redis import asyncio as aioredis
 
 # --- Application Imports ---
-from app.database import engine
-from app.models import Base
+from app.migrations import migrate
 from app.api import router as api_router
-from app.limiter import limiter
 from app.settings import settings
 from app.minio_service import minio_client
+from app.services import room_dispatcher, reload_blocklist, listen_for_blocklist_reloads, spam_buckets
+from app.ingest import message_ingest
+from app.read_state import read_state_flusher
+from app.session_cache import session_cache
+from app.sharding import shard_router
+from app.presence import presence
+from app.deps import pin_reads_to_primary
+from app.upload_limit import FORM_OVERHEAD_BYTES, UploadSizeLimit
+
+
+# --- Lifespan ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print("--- Starting up application ---")
 
+    # Schema and bucket checks belong to deploys (python migrate.py), not to
+    # every cold start.
+    if settings.MIGRATE_ON_STARTUP:
+        await migrate()
+
+    # Independent of each other; dispatcher subscriptions are serialised by its lock.
+    await asyncio.gather(
+        session_cache.listen(),
+        reload_blocklist(),
+        listen_for_blocklist_reloads(),
+        shard_router.start(),
+        presence.start(),
+        message_ingest.start(),
+        read_state_flusher.start(),
+        spam_buckets.start(),
+    )
+    warm_up = asyncio.create_task(minio_client.warm_up())
+    print("--- Application startup complete ---")
 
-# --- Database Initialization ---
-async def create_db_and_tables():
-    """Create database tables on startup."""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    yield
+
+    warm_up.cancel()
+    await shard_router.close()
+    await presence.close()
+    await message_ingest.close()
+    await read_state_flusher.close()
+    await spam_buckets.close()
+    await room_dispatcher.close()
 
 
 # --- FastAPI Application Setup ---
@@ -137,6 +168,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url=None,   # disable default Swagger docs
     redoc_url=None,  # disable default ReDoc
+    lifespan=lifespan,
 )
 
 
@@ -163,36 +195,6 @@ async def get_scalar_docs() -> HTMLResponse:
 
 Instrumentator().instrument(app).expose(app)
 
-@app.on_event("startup")
-async def on_startup():
-    print("--- Starting up application ---")
-
-    await create_db_and_tables()
-    print("✅ Database tables initialized.")
-
-    redis_url = settings.REDIS_URL
-    if not redis_url.startswith("redis://") and not redis_url.startswith("rediss://"):
-        print("⚠️ Warning: REDIS_URL missing scheme. Defaulting to rediss://")
-        redis_url = f"rediss://{redis_url}"
-    
-    # Mask password for logging
-    masked_redis = redis_url.split("@")[-1] if "@" in redis_url else "********"
-    print(f"Connecting to Redis at ...{masked_redis}")
-
-    redis_conn = aioredis.from_url(
-        redis_url,
-        encoding="utf8",
-        decode_responses=True,
-    )
-    FastAPICache.init(RedisBackend(redis_conn), prefix="fastapi-cache")
-    print("✅ Redis cache initialized.")
-
-    minio_client.initialize_bucket()
-    print("✅ MinIO bucket ready.")
-
-    print("--- Application startup complete ---")
-
-
 origins = [
     "http://localhost",
     "http://localhost:5173",
@@ -203,6 +205,12 @@ allowed_origins_env = os.getenv("ALLOWED_ORIGINS")
 if allowed_origins_env:
     origins.extend([origin.strip() for origin in allowed_origins_env.split(",") if origin.strip()])
 
+# Inside CORS, so browsers can read the 413.
+app.add_middleware(
+    UploadSizeLimit,
+    paths={"/api/v1/upload-file"},
+    max_bytes=settings.UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+)
 app.add_middleware(
     CORSMiddleware,
     # allow_origins=["*"], # Invalid with allow_credentials=True
@@ -210,10 +218,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Keeps a client's reads on the primary briefly after any successful write."""
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        pin_reads_to_primary(response)
+    return response
 
 
 app.include_router(api_router, prefix="/api/v1")
@@ -0,0 +1,21 @@
+"""
+Creates missing tables, applies schema upgrades and ensures the upload bucket
+exists. Run once per deploy, before starting the new app version:
+
+    python migrate.py
+"""
+import asyncio
+
+from app.database import engine
+from app.migrations import migrate
+
+
+async def main():
+    try:
+        await migrate()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Import-time profile of the app, to keep cold starts in check.
+
+Imports `main` in a fresh interpreter under `python -X importtime` and lists
+the slowest modules (cumulative, including their own imports) and the slowest
+module bodies (self time, where import-time work such as building clients
+shows up):
+
+    python profile_startup.py
+    python profile_startup.py --top 30 --budget-ms 1500   # exit 1 over budget
+
+Needs the same environment variables as the app; no services are contacted.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def profile(module: str):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail if the total import time exceeds this.")
+    args = parser.parse_args()
+
+    rows = profile(args.module)
+    total_ms = next(cumulative for name, _, cumulative in rows if name == args.module) / 1000
+
+    print(f"Total import time of {args.module}: {total_ms:.0f} ms\n")
+    print("Slowest imports (cumulative ms):")
+    for name, _, cumulative in sorted(rows, key=lambda row: row[2], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f}  {name}")
+    print("\nSlowest module bodies (self ms):")
+    for name, self_us, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f}  {name}")
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"\nOver budget: {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import random
 from faker import Faker
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, models, schemas
+from app import crud, models, read_state, schemas
 from app.database import AsyncSessionLocal, engine
 
 fake = Faker()
@@ -67,7 +67,8 @@ async def seed_data():
                 message_in = schemas.MessageCreate(
                     content=fake.sentence(nb_words=random.randint(3, 15))
                 )
-                await crud.create_message(db=db, message=message_in, room_id=room.id, user_id=author.id)
+                seq = await read_state.next_room_seq(room.id, author.id)
+                await crud.create_message(db=db, message=message_in, room_id=room.id, user_id=author.id, seq=seq)
                 messages_count += 1
         print(f"✅ Created {messages_count} messages.")
 
@@ -0,0 +1,18 @@
+import pytest
+
+from tests.support import add_room_with_member, loop, reset_schema, run, use_fake_redis  # noqa: F401
+from app.database import AsyncSessionLocal
+
+
+@pytest.fixture
+def room(run):
+    """A fresh schema and Redis holding one user in one room."""
+    async def setup():
+        use_fake_redis()
+        await reset_schema()
+        async with AsyncSessionLocal() as db:
+            user, room = await add_room_with_member(db, "tester")
+            await db.commit()
+            return user, room
+
+    return run(setup)
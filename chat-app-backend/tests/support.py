@@ -0,0 +1,65 @@
+"""
+Fixtures shared by tests/ and benchmarks/: a throwaway SQLite database
+(TEST_DATABASE_URL overrides it) and an in-process fakeredis. Settings are
+read at import time, so conftest modules import this before anything in app.
+"""
+import asyncio
+import os
+import tempfile
+from typing import Tuple
+
+import fakeredis
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite+aiosqlite:///{_db_dir}/test.db")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+os.environ.setdefault("SESSION_SECRET_KEY", "test")
+os.environ.setdefault("MINIO_ENDPOINT", "localhost:9000")
+os.environ.setdefault("MINIO_ACCESS_KEY", "test")
+os.environ.setdefault("MINIO_SECRET_KEY", "test")
+
+from app import models, services  # noqa: E402
+from app.database import engine  # noqa: E402
+from app.migrations import upgrade_schema  # noqa: E402
+
+
+def use_fake_redis():
+    """Points both Redis clients at a fresh, empty fakeredis server."""
+    server = fakeredis.FakeServer()
+    services.redis_manager.redis_conn = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    services.redis_manager.redis_bytes = fakeredis.aioredis.FakeRedis(server=server)
+
+
+async def reset_schema():
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await upgrade_schema(conn)
+
+
+async def add_room_with_member(db, name: str) -> Tuple[models.User, models.Room]:
+    """Adds a user named `name` and a room they own and belong to; the caller commits."""
+    user = models.User(name=name)
+    db.add(user)
+    await db.flush()
+    room = models.Room(name=f"{name}-room", owner_id=user.id)
+    db.add(room)
+    await db.flush()
+    db.add(models.RoomMember(room_id=room.id, user_id=user.id))
+    return user, room
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    use_fake_redis()
+    yield loop
+    loop.run_until_complete(engine.dispose())
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def run(loop):
+    """Runs a coroutine function to completion on the shared loop."""
+    return lambda fn, *args: loop.run_until_complete(fn(*args))
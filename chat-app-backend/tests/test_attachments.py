@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import insert, select
+
+from app import models, schemas, security
+from app.database import engine
+from app.ingest import InvalidAttachment, MessageIngest
+from app.migrations import backfill_attachment_keys
+from app.minio_service import minio_client
+
+
+def test_only_keys_signed_for_the_sender_are_attached(room):
+    user, _ = room
+    signed = security.sign_file_key(user.id, "abc-photo.png")
+
+    stored = MessageIngest._store_attachment_key(user, schemas.MessageCreate(content="", file_key=signed, type="file"))
+    assert stored.file_key == "abc-photo.png"
+    assert stored.file_url is None
+
+    for file_key in ("abc-photo.png", security.sign_file_key(user.id + 1, "abc-photo.png")):
+        with pytest.raises(InvalidAttachment):
+            MessageIngest._store_attachment_key(user, schemas.MessageCreate(content="", file_key=file_key, type="file"))
+
+
+def test_backfill_recovers_keys_from_our_presigned_urls_only(run, room):
+    user, room = room
+    bucket_url = f"{minio_client.endpoint}/{minio_client.bucket_name}"
+    urls = {
+        1: minio_client.generate_presigned_url("old-photo.png"),
+        2: f"{bucket_url}/secret.pdf",
+        3: f"https://elsewhere.example/{minio_client.bucket_name}/x.png?X-Amz-Signature=0",
+    }
+
+    async def scenario():
+        async with engine.begin() as conn:
+            await conn.execute(insert(models.Message), [
+                {"id": message_id, "seq": message_id, "room_id": room.id, "user_id": user.id,
+                 "content": "", "type": "file", "file_url": url}
+                for message_id, url in urls.items()
+            ])
+            await backfill_attachment_keys(conn)
+            result = await conn.execute(select(models.Message.id, models.Message.file_key).order_by(models.Message.id))
+            return result.all()
+
+    assert run(scenario) == [(1, "old-photo.png"), (2, None), (3, None)]
@@ -0,0 +1,60 @@
+from app.cache import ResponseCache
+from app.services import redis_manager
+
+
+def make_endpoint(cache: ResponseCache, before_return=None):
+    calls = []
+
+    @cache.cached(int, ttl=60, key=lambda kw: f"value:{kw['room_id']}", tags=lambda kw, result: [f"room:{kw['room_id']}"])
+    async def endpoint(room_id: int, db=None):
+        calls.append(room_id)
+        if before_return is not None:
+            await before_return()
+        return len(calls)
+
+    return endpoint, calls
+
+
+def test_cached_until_invalidated(run, room):
+    cache = ResponseCache(prefix="test-cache")
+    endpoint, calls = make_endpoint(cache)
+
+    async def scenario():
+        first = await endpoint(room_id=1)
+        again = await endpoint(room_id=1)
+        await cache.invalidate("room:1")
+        rebuilt = await endpoint(room_id=1)
+        return first, again, rebuilt
+
+    assert run(scenario) == (1, 1, 2)
+    assert len(calls) == 2
+
+
+def test_rebuild_racing_an_invalidation_is_not_stored(run, room):
+    cache = ResponseCache(prefix="test-cache")
+
+    async def invalidate_midway():
+        # A write commits and invalidates while the result is being computed.
+        await cache.invalidate("room:1")
+
+    endpoint, calls = make_endpoint(cache, before_return=invalidate_midway)
+
+    async def scenario():
+        await endpoint(room_id=1)
+        await endpoint(room_id=1)
+
+    run(scenario)
+    assert calls == [1, 1]
+
+
+def test_waiting_past_another_workers_lock_leaves_it_in_place(run, room):
+    cache = ResponseCache(prefix="test-cache")
+    cache.LOCK_SECONDS = 0.1
+    endpoint, calls = make_endpoint(cache)
+
+    async def scenario():
+        await redis_manager.redis_conn.set("test-cache:value:1:lock", "other-worker", ex=60)
+        result = await endpoint(room_id=1)
+        return result, await redis_manager.redis_conn.get("test-cache:value:1:lock")
+
+    assert run(scenario) == (1, "other-worker")
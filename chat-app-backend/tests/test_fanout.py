@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from app.services import ConnectionManager, RoomDispatcher, redis_manager
+
+
+class StalledSocket:
+    """A WebSocket whose sends wait until `unblock` is set."""
+
+    def __init__(self):
+        self.sent = []
+        self.unblock = asyncio.Event()
+
+    async def send_text(self, frame: str):
+        await self.unblock.wait()
+        self.sent.append(frame)
+
+    async def close(self, code: int, reason: str = ""):
+        self.closed = code
+
+
+def test_coalesced_frames_go_out_as_one_array(run):
+    manager = ConnectionManager()
+    manager.policy = "coalesce"
+    manager.queue_size = 1
+
+    async def scenario():
+        socket = StalledSocket()
+        await manager.connect(socket, room_id=1)
+        frames = [json.dumps({"n": n}) for n in range(4)]
+        await manager.broadcast_to_room(1, frames[0])
+        await asyncio.sleep(0)  # The writer takes the first frame and stalls on it.
+        for frame in frames[1:]:
+            await manager.broadcast_to_room(1, frame)
+        socket.unblock.set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        manager.disconnect(socket, 1)
+        return socket.sent
+
+    sent = run(scenario)
+    assert [json.loads(frame) for frame in sent] == [{"n": 0}, [{"n": 1}, {"n": 2}, {"n": 3}]]
+
+
+def test_consumer_overflowing_during_replay_is_evicted(run):
+    manager = ConnectionManager()
+    manager.policy = "disconnect"
+    manager.queue_size = 1
+    dispatcher = RoomDispatcher(redis_manager, manager)
+
+    async def scenario():
+        socket = StalledSocket()
+        connection = await manager.connect(socket, room_id=1, replay=True)
+        for n in range(3):
+            await manager.broadcast_to_room(1, json.dumps({"n": n}))  # Held until the replay
+        await dispatcher.replay(connection, 1, "0-0")
+        await asyncio.sleep(0)
+        return socket
+
+    socket = run(scenario)
+    assert 1 not in manager.active_connections
+    assert socket.closed == 1013
@@ -0,0 +1,60 @@
+from app import crud, schemas
+from app.database import AsyncSessionLocal
+from app.ingest import MessageIngest
+
+
+def make_ingest(first_id: int) -> MessageIngest:
+    """A write-behind ingest whose allocator owns the id block starting at `first_id`."""
+    ingest = MessageIngest()
+    ingest.write_behind = True
+    ingest.ack_mode = "commit"
+
+    async def reserve_block():
+        ingest.id_allocator._ids = list(range(first_id + 99, first_id - 1, -1))
+
+    ingest.id_allocator._reserve_block = reserve_block
+    return ingest
+
+
+def test_history_follows_send_order_across_allocators(run, room):
+    user, room = room
+    workers = [make_ingest(1), make_ingest(101)]
+
+    async def scenario():
+        for worker in workers:
+            await worker.start()
+        # Alternate workers so that ids and send order disagree.
+        for worker in (workers[1], workers[0], workers[1], workers[0]):
+            await worker.submit(user, room.id, schemas.MessageCreate(content="hi"))
+        for worker in workers:
+            await worker.close()
+        async with AsyncSessionLocal() as db:
+            newest_first = await crud.get_messages_page(db, room.id)
+            after_first = await crud.get_messages_page(db, room.id, after_id=101)
+            before_last = await crud.get_messages_page(db, room.id, before_id=2)
+        return newest_first, after_first, before_last
+
+    newest_first, after_first, before_last = run(scenario)
+    assert [m.id for m in newest_first] == [2, 102, 1, 101]
+    assert [m.seq for m in newest_first] == [4, 3, 2, 1]
+    assert [m.id for m in after_first] == [2, 102, 1]
+    assert [m.id for m in before_last] == [102, 1, 101]
+
+
+def test_failing_row_does_not_sink_its_batch(run, room):
+    user, room = room
+    ingest = make_ingest(1)
+
+    async def scenario():
+        good = {"room_id": room.id, "user_id": user.id, "content": "ok", "type": "text"}
+        rows = [
+            {**good, "id": 1, "seq": 1},
+            {**good, "id": 1, "seq": 2},  # duplicate primary key
+            {**good, "id": 2, "seq": 3},
+        ]
+        await ingest._flush([(row, None) for row in rows])
+        async with AsyncSessionLocal() as db:
+            return await crud.get_messages_page(db, room.id)
+
+    stored = run(scenario)
+    assert [(m.id, m.seq) for m in stored] == [(2, 3), (1, 1)]
@@ -0,0 +1,39 @@
+import datetime
+
+from app import crud, models, schemas
+from app.database import AsyncSessionLocal
+from app.deps import resolve_session_user
+from app.session_cache import SessionCache, session_cache
+
+
+def test_entry_does_not_outlive_its_session():
+    cache = SessionCache(max_size=10, ttl=60, negative_ttl=5)
+    user = object()
+
+    cache.put("live", user, expires_at=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    cache.put("ending", user, expires_at=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+
+    assert cache.get("live") == (True, user)
+    assert cache.get("ending") == (False, None)
+
+
+def test_create_room_after_a_session_cache_hit(run, room):
+    user, _ = room
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            db.add(models.Session(
+                id="cached-session",
+                user_id=user.id,
+                expires_at=datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+            ))
+            await db.commit()
+        session_cache.drop_session("cached-session")
+        async with AsyncSessionLocal() as db:
+            await resolve_session_user(db, "cached-session")  # miss: fills the cache
+        async with AsyncSessionLocal() as db:
+            current_user = await resolve_session_user(db, "cached-session")  # hit
+            new_room = await crud.create_room(db, schemas.RoomCreate(name="after-hit"), current_user)
+            return schemas.Room.model_validate(new_room)
+
+    assert run(scenario).owner.id == user.id
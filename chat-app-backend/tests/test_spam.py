@@ -0,0 +1,33 @@
+import pytest
+
+from app import services
+from app.services import SharedTokenBuckets
+
+
+def test_workers_share_a_users_budget_after_syncing(run, room):
+    user, _ = room
+    # Two workers; a long window so nothing refills during the test.
+    first, second = (SharedTokenBuckets(5, 1000, sync_interval=60) for _ in range(2))
+
+    assert all(first.take(user.id) for _ in range(5))
+    run(first.sync)
+    assert not first.take(user.id)
+
+    # The second worker has not heard of the user yet: one burst at most.
+    assert second.take(user.id)
+    run(second.sync)
+    assert not second.take(user.id)
+
+
+def test_tokens_are_kept_for_the_next_sync_when_one_fails(run, room, monkeypatch):
+    user, _ = room
+    buckets = SharedTokenBuckets(5, 1000, sync_interval=60)
+    buckets.take(user.id)
+
+    def unavailable(source):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(services.redis_manager, "script", unavailable)
+    with pytest.raises(ConnectionError):
+        run(buckets.sync)
+    assert buckets._taken == {user.id: 1}
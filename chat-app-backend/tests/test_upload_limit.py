@@ -0,0 +1,57 @@
+import asyncio
+
+from app.upload_limit import UploadSizeLimit
+
+
+def form_parsing_app(read):
+    """Reads the whole body like a form parser, answering 400 if reading fails (as FastAPI does)."""
+    async def app(scope, receive, send):
+        status = 200
+        try:
+            while True:
+                message = await receive()
+                read.append(len(message["body"]))
+                if not message.get("more_body"):
+                    break
+        except Exception:
+            status = 400
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def call(middleware, headers, chunks):
+    sent = []
+
+    async def receive():
+        body = chunks.pop(0)
+        return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/api/v1/upload-file", "headers": headers}
+    asyncio.run(middleware(scope, receive, send))
+    return [message["status"] for message in sent if message["type"] == "http.response.start"]
+
+
+def test_declared_oversized_body_is_refused_unread():
+    read = []
+    middleware = UploadSizeLimit(form_parsing_app(read), paths={"/api/v1/upload-file"}, max_bytes=25)
+    assert call(middleware, [(b"content-length", b"50")], [b"x" * 10] * 5) == [413]
+    assert read == []
+
+
+def test_body_is_cut_off_once_it_passes_the_limit():
+    read = []
+    middleware = UploadSizeLimit(form_parsing_app(read), paths={"/api/v1/upload-file"}, max_bytes=25)
+    # No Content-Length, as with chunked transfer encoding.
+    assert call(middleware, [], [b"x" * 10] * 5) == [413]
+    assert read == [10, 10]
+
+
+def test_body_within_the_limit_passes_through():
+    read = []
+    middleware = UploadSizeLimit(form_parsing_app(read), paths={"/api/v1/upload-file"}, max_bytes=25)
+    assert call(middleware, [(b"content-length", b"20")], [b"x" * 10] * 2) == [200]
@@ -8,6 +8,12 @@ import axios from "axios";
 const isLocal = window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1';
 const API_URL = isLocal ? "http://localhost:8000/api/v1" : "/api/v1";
 const WS_URL = isLocal ? "ws://localhost:8000/api/v1/ws" : "wss://openchatroomm.onrender.com/api/v1/ws";
+// Close code a sharded backend uses to send a socket to the worker owning its
+// room; the reason carries that worker's base URL.
+const WS_WRONG_SHARD = 4307;
+const MAX_SHARD_REDIRECTS = 3;
+// Read marks are batched: at most one per interval, carrying the newest seq.
+const READ_MARK_INTERVAL_MS = 2000;
 
 // --- API CLIENT ---
 const apiClient = axios.create({
@@ -35,6 +41,7 @@ export const getMyRooms = () => apiClient.get("/rooms/my");
 export const deleteRoom = (roomId) => apiClient.delete(`/rooms/${roomId}`);
 export const joinRoom = (roomId) => apiClient.post(`/rooms/${roomId}/join`);
 export const leaveRoom = (roomId) => apiClient.post(`/rooms/${roomId}/leave`);
+export const markRoomRead = (roomId) => apiClient.post(`/rooms/${roomId}/read`, {});
 
 export const getRoomMembers = (roomId) => apiClient.get(`/rooms/${roomId}/members`);
 export const getRoomMessages = (roomId) => apiClient.get(`/rooms/${roomId}/messages`);
@@ -234,22 +241,69 @@ function App() {
         if (ws.current) ws.current.close();
         setMessages([]); // Clear prev chats
 
+        let stopped = false;
+        let retries = 0;
+        let redirects = 0;
+        let retryTimer = null;
+        let wsBase = WS_URL; // The room's worker, once a sharded backend has named it
+        // Set from frames of the streams backend; a reconnect then resumes
+        // from it instead of reloading history over HTTP.
+        let lastEventId = null;
+        let readSeq = 0; // Newest seq seen in this room
+        let sentReadSeq = 0;
+        let readTimer = null;
+
+        const sendReadMark = () => {
+            readTimer = null;
+            // Only a room someone is looking at gets read.
+            if (readSeq <= sentReadSeq || !document.hasFocus()) return;
+            if (ws.current?.readyState !== WebSocket.OPEN) return;
+            ws.current.send(JSON.stringify({ action: 'mark_read', seq: readSeq }));
+            sentReadSeq = readSeq;
+        };
+
+        const queueReadMark = (seq) => {
+            if (!seq || seq <= readSeq) return;
+            readSeq = seq;
+            if (!readTimer) readTimer = setTimeout(sendReadMark, READ_MARK_INTERVAL_MS);
+        };
+        window.addEventListener('focus', sendReadMark);
+
+        const loadHistory = async (withMembers = true) => {
+            const [msgs, mems] = await Promise.all([
+                getRoomMessages(selectedRoom.id),
+                withMembers ? getRoomMembers(selectedRoom.id) : null
+            ]);
+            if (stopped) return; // Switched rooms meanwhile
+            // Keep anything that arrived live while the page was loading.
+            const history = msgs.data.reverse();
+            const known = new Set(history.map(m => m.id));
+            setMessages(p => [...history, ...p.filter(m => !known.has(m.id))]);
+            if (mems) setMembers(mems.data);
+            markRoomRead(selectedRoom.id).catch(console.error);
+            clearUnread(selectedRoom.id);
+        };
+
+        const scheduleReconnect = () => {
+            setIsConnecting(true);
+            if (retries === 0) setNotification("Connection lost. Reconnecting...");
+            const delay = Math.min(1000 * 2 ** retries, 30000);
+            retries += 1;
+            // Stay on the room's worker, unless it keeps failing: then let the
+            // default endpoint route us to whichever worker owns the room now.
+            if (retries > MAX_SHARD_REDIRECTS) wsBase = WS_URL;
+            retryTimer = setTimeout(connect, delay);
+        };
+
         const connect = async () => {
             setIsConnecting(true);
             try {
-                // 1. Fetch History HTTP
-                const [msgs, mems] = await Promise.all([
-                    getRoomMessages(selectedRoom.id),
-                    getRoomMembers(selectedRoom.id)
-                ]);
-                setMessages(msgs.data.reverse());
-                setMembers(mems.data);
-
-                // 2. Get Token
                 const { data } = await getSessionToken();
+                if (stopped) return;
 
-                // 3. Connect WS (Bypassing Vercel Proxy)
-                const wsEndpoint = `${WS_URL}/${selectedRoom.id}?token=${data.token}`;
+                // Connect WS (Bypassing Vercel Proxy)
+                const resume = lastEventId ? `&last_event_id=${encodeURIComponent(lastEventId)}` : '';
+                const wsEndpoint = `${wsBase}/${selectedRoom.id}?token=${data.token}${resume}`;
                 console.log("Connecting WS:", wsEndpoint);
 
                 const socket = new WebSocket(wsEndpoint);
@@ -258,36 +312,87 @@ function App() {
                 socket.onopen = () => {
                     console.log("WS Open");
                     setIsConnecting(false);
+                    // After a drop or a move to another worker, catch up on what was
+                    // sent meanwhile. The streams backend replays it from lastEventId;
+                    // pub/sub keeps no history, so reload the latest page instead.
+                    if ((retries > 0 || redirects > 0) && !lastEventId) loadHistory(false).catch(console.error);
+                    if (retries > 0) setNotification(null);
+                    retries = 0;
+                    redirects = 0;
                 };
 
-                socket.onmessage = (e) => {
-                    const msg = JSON.parse(e.data);
+                const handleFrame = (msg) => {
+                    if (msg.type === 'error') {
+                        setNotification(msg.detail);
+                        return;
+                    }
+                    if (msg.event_id) lastEventId = msg.event_id;
                     if (msg.room_id === selectedRoom.id) {
                         setMessages(p => {
                             if (p.find(m => m.id === msg.id)) return p;
                             return [...p, msg];
                         });
+                        queueReadMark(msg.seq);
                     }
                     if (!document.hasFocus() && msg.author?.id !== user.id) showBrowserNotification(selectedRoom, msg);
                 };
 
+                socket.onmessage = (e) => {
+                    const data = JSON.parse(e.data);
+                    // A backlogged socket may get several messages batched into one array.
+                    (Array.isArray(data) ? data : [data]).forEach(handleFrame);
+                };
+
                 socket.onerror = (e) => {
-                    console.error("WS Error", e);
-                    setNotification("Connection Error");
-                    setIsConnecting(false);
+                    console.error("WS Error", e); // onclose decides whether to reconnect
                 };
 
-                // Auto-reconnect logic could be added here
+                socket.onclose = (e) => {
+                    if (stopped || ws.current !== socket) return;
+                    if (e.code === WS_WRONG_SHARD && e.reason && redirects < MAX_SHARD_REDIRECTS) {
+                        // The room lives on another worker, named in the close reason.
+                        redirects += 1;
+                        wsBase = `${e.reason}/api/v1/ws`;
+                        connect();
+                    } else if (e.code === 1008) {
+                        // Policy close (not a member, spam): reconnecting won't help.
+                        setNotification(e.reason || "Disconnected");
+                        setIsConnecting(false);
+                    } else {
+                        scheduleReconnect();
+                    }
+                };
             } catch (e) {
                 console.error(e);
-                setNotification("Connection Failed: " + (e.response?.status === 401 ? "Login Expired" : "Network Error"));
-                setIsConnecting(false);
+                if (e.response?.status === 401) {
+                    setNotification("Connection Failed: Login Expired");
+                    setIsConnecting(false);
+                } else if (!stopped) {
+                    scheduleReconnect();
+                }
             }
         };
-        connect();
-        return () => ws.current?.close();
+
+        setIsConnecting(true);
+        loadHistory()
+            .catch(e => {
+                console.error(e);
+                setNotification("Connection Failed: " + (e.response?.status === 401 ? "Login Expired" : "Network Error"));
+            })
+            .finally(() => { if (!stopped) connect(); });
+        return () => {
+            stopped = true;
+            clearTimeout(retryTimer);
+            clearTimeout(readTimer);
+            window.removeEventListener('focus', sendReadMark);
+            ws.current?.close();
+        };
     }, [selectedRoom, user]);
 
+    const clearUnread = (roomId) => {
+        setMyRooms(rooms => rooms.map(r => r.id === roomId ? { ...r, unread_count: 0 } : r));
+    };
+
     useEffect(() => messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' }), [messages]);
 
     const handleRoomSelect = async (room) => {
@@ -339,7 +444,7 @@ function App() {
             const { data } = await uploadFile(file);
             setNotification(null);
             if (ws.current?.readyState === WebSocket.OPEN) {
-                ws.current.send(JSON.stringify({ content: '', file_url: data.file_url, type: 'file' }));
+                ws.current.send(JSON.stringify({ content: '', file_key: data.file_key, file_url: data.file_url, type: 'file' }));
             }
         } catch (err) {
             console.error(err);